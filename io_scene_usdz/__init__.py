@@ -63,7 +63,10 @@ class ImportUSDZ(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         from . import import_usdz
         keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_usdz.import_usdz(context, **keywords)
+        result = import_usdz.import_usdz(context, **keywords)
+        if result == {'CANCELLED'}:
+            self.report({'ERROR'}, "Failed to read " + self.filepath)
+        return result
 
     def draw(self, context):
         pass
@@ -147,11 +150,38 @@ class ExportUSDZ(bpy.types.Operator, ExportHelper):
         max=1000.0,
         default=1.0,
     )
+    maxInfluences: IntProperty(
+        name="Max Influences",
+        description="Maximum Number of Joint Weights per Vertex, 0 Keeps All",
+        min=0,
+        max=32,
+        default=0,
+    )
+    meshCachePath: StringProperty(
+        name="Mesh Cache",
+        description="Folder to Cache Exported Meshes for Later Exports, Empty Disables the Cache",
+        subtype='DIR_PATH',
+        default="",
+    )
     useConverter: BoolProperty(
         name="Use Usdz Converter Tool",
         description="Use Apple's Converter Tool to create the Usdz file",
         default=False,
     )
+    compressionLevel: IntProperty(
+        name="Compression",
+        description="Compression Level of the usdc Data, 0 is Fastest and 9 is Smallest",
+        min=0,
+        max=9,
+        default=1,
+    )
+    compressionWorkers: IntProperty(
+        name="Compression Processes",
+        description="Number of Processes used to Compress the usdc Sections, Processes need Blender 2.91 or Later",
+        min=1,
+        max=64,
+        default=1,
+    )
 
     def execute(self, context):
         from . import export_usdz
@@ -161,7 +191,7 @@ class ExportUSDZ(bpy.types.Operator, ExportHelper):
                                             "check_existing",
                                             "filter_glob",
                                             ))
-        return export_usdz.export_usdz(context, **keywords)
+        return export_usdz.export_usdz(context, report = self.report, **keywords)
 
     def draw(self, context):
         pass
@@ -191,6 +221,10 @@ class USDZ_PT_export_include(bpy.types.Panel):
         col.prop(operator, 'exportMaterials')
         col.prop(operator, 'exportAnimations')
         layout.prop(operator, 'globalScale')
+        layout.prop(operator, 'maxInfluences')
+        layout.prop(operator, 'meshCachePath')
+        layout.prop(operator, 'compressionLevel')
+        layout.prop(operator, 'compressionWorkers')
 
 
 class USDZ_PT_export_textures(bpy.types.Panel):
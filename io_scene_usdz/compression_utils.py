@@ -1,11 +1,53 @@
 
+import os
+import sys
+import struct
+import importlib
+import multiprocessing
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import lz4.block as lz4Block
+except ImportError:
+    lz4Block = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 MAX_BLOCK_INPUT_SIZE = 0x7E000000
 
+# Workers import this file as a top level module, the add-on package
+# __init__ imports bpy which the Python of a spawned worker doesn't have
+WORKER_MODULE = 'compression_utils'
+
 MAX_OFFSET = 65535
 MIN_MATCH = 4
 MFLIMIT = 12
+LAST_LITERALS = 5
+
+FAST_HASH_LOG = 16
+HIGH_HASH_LOG = 15
+SKIP_TRIGGER = 4
+
+LZ4_LEVEL_FAST = 0
+LZ4_LEVEL_DEFAULT = 1
+LZ4_LEVEL_MAX = 9
+# Level 0 probes every 4th position, each level below doubles the step
+LZ4_FAST_ACCELERATION = 4
+# Chain attempts grow linearly per level instead of doubling
+LZ4_HIGH_ATTEMPTS_STEP = 8
+
+# Byte widths for the 1, 2 and 3 codes of the USD integer encoding
+INT32_WIDTHS = (1, 2, 4)
+INT64_WIDTHS = (2, 4, 8)
+# Smaller arrays are faster without the NumPy setup cost
+NUMPY_MIN_INTS = 64
+
+INT_FORMATS = {1:'B', 2:'H', 4:'I', 8:'Q'}
 
 
 def decodeStrings(data, count, encoding='utf-8'):
@@ -27,6 +69,10 @@ def encodeStrings(strings, encoding='utf-8'):
 
 
 def decodeInts(data, count, size, byteorder='little', signed=False):
+    if size in INT_FORMATS and count * size <= len(data):
+        format = ('<' if byteorder == 'little' else '>') + '%d' % count
+        format += INT_FORMATS[size].lower() if signed else INT_FORMATS[size]
+        return list(struct.unpack_from(format, data))
     ints = []
     for i in range(count):
         if i * size > len(data):
@@ -180,7 +226,173 @@ def lz4CompressDefault(src):
                            (0, 0))
     return dst[:dstPtr]
 
-def lz4Compress(src):
+def hashSequence(src, pos, hashLog):
+    val = int.from_bytes(src[pos:pos+4], 'little')
+    return ((val * 2654435761) & 0xFFFFFFFF) >> (32 - hashLog)
+
+
+def countMatchFast(src, front, back, max):
+    # Compare in shrinking blocks instead of one byte at a time
+    start = back
+    step = 64
+    while step > 0:
+        while back + step <= max and src[front:front+step] == src[back:back+step]:
+            front += step
+            back += step
+        step >>= 3
+    return back - start
+
+
+def lz4CompressFast(src, acceleration = 1):
+    srcLen = len(src)
+    if srcLen > MAX_BLOCK_INPUT_SIZE:
+        return b''
+    src = bytes(src)
+    dst = bytearray(worstCaseBlockLength(srcLen))
+    table = [-1] * (1 << FAST_HASH_LOG)
+    srcPtr = 0
+    literalHead = 0
+    dstPtr = 0
+    MAX_INDEX = srcLen - MFLIMIT
+    MATCH_LIMIT = srcLen - LAST_LITERALS
+    HASH_SHIFT = 32 - FAST_HASH_LOG
+    searchCount = acceleration << SKIP_TRIGGER
+
+    while srcPtr < MAX_INDEX:
+        # Inline hashSequence, it runs once for every probed position
+        hash = ((readLeUint32(src, srcPtr) * 2654435761) & 0xFFFFFFFF) >> HASH_SHIFT
+        matchPos = table[hash]
+        table[hash] = srcPtr
+        if (matchPos >= 0 and srcPtr - matchPos <= MAX_OFFSET and
+                src[matchPos:matchPos+4] == src[srcPtr:srcPtr+4]):
+            length = MIN_MATCH + countMatchFast(src, matchPos + MIN_MATCH,
+                                                srcPtr + MIN_MATCH, MATCH_LIMIT)
+            dstPtr += copySequence(dst, dstPtr,
+                                   memoryview(src)[literalHead:srcPtr],
+                                   (srcPtr - matchPos, length))
+            srcPtr += length
+            literalHead = srcPtr
+            searchCount = acceleration << SKIP_TRIGGER
+        else:
+            # Step further ahead the longer no match is found
+            srcPtr += searchCount >> SKIP_TRIGGER
+            searchCount += 1
+    # Write the last literal
+    dstPtr += copySequence(dst, dstPtr,
+                           memoryview(src)[literalHead:srcLen],
+                           (0, 0))
+    return dst[:dstPtr]
+
+
+def lz4CompressHigh(src, maxAttempts):
+    srcLen = len(src)
+    if srcLen > MAX_BLOCK_INPUT_SIZE:
+        return b''
+    src = bytes(src)
+    dst = bytearray(worstCaseBlockLength(srcLen))
+    head = [-1] * (1 << HIGH_HASH_LOG)
+    # Distance to the previous position with the same hash
+    chain = [0] * (MAX_OFFSET + 1)
+    nextInsert = 0
+    srcPtr = 0
+    literalHead = 0
+    dstPtr = 0
+    MAX_INDEX = srcLen - MFLIMIT
+    MATCH_LIMIT = srcLen - LAST_LITERALS
+
+    while srcPtr < MAX_INDEX:
+        # Add the skipped positions to the hash chains
+        while nextInsert <= srcPtr:
+            hash = hashSequence(src, nextInsert, HIGH_HASH_LOG)
+            prev = head[hash]
+            delta = nextInsert - prev if prev >= 0 else 0
+            chain[nextInsert & MAX_OFFSET] = delta if delta <= MAX_OFFSET else 0
+            head[hash] = nextInsert
+            nextInsert += 1
+        # Walk the chain for the longest match
+        bestLen = 0
+        bestPos = 0
+        maxLen = MATCH_LIMIT - srcPtr
+        sequence = src[srcPtr:srcPtr+4]
+        delta = chain[srcPtr & MAX_OFFSET]
+        matchPos = srcPtr - delta
+        attempts = maxAttempts
+        while delta > 0 and srcPtr - matchPos <= MAX_OFFSET and attempts > 0:
+            attempts -= 1
+            if (src[matchPos + bestLen] == src[srcPtr + bestLen] and
+                    src[matchPos:matchPos+4] == sequence):
+                length = MIN_MATCH + countMatchFast(src, matchPos + MIN_MATCH,
+                                                    srcPtr + MIN_MATCH, MATCH_LIMIT)
+                if length > bestLen:
+                    bestLen = length
+                    bestPos = matchPos
+                    if bestLen >= maxLen:
+                        break
+            delta = chain[matchPos & MAX_OFFSET]
+            matchPos -= delta
+        if bestLen >= MIN_MATCH:
+            dstPtr += copySequence(dst, dstPtr,
+                                   memoryview(src)[literalHead:srcPtr],
+                                   (srcPtr - bestPos, bestLen))
+            srcPtr += bestLen
+            literalHead = srcPtr
+        else:
+            srcPtr += 1
+    # Write the last literal
+    dstPtr += copySequence(dst, dstPtr,
+                           memoryview(src)[literalHead:srcLen],
+                           (0, 0))
+    return dst[:dstPtr]
+
+
+def lz4CompressBlock(src, level = LZ4_LEVEL_DEFAULT):
+    if level <= LZ4_LEVEL_FAST:
+        # Negative levels trade more compression for speed
+        return lz4CompressFast(src, LZ4_FAST_ACCELERATION << min(-level, 4))
+    if level == LZ4_LEVEL_DEFAULT:
+        return lz4CompressDefault(src)
+    level = min(level, LZ4_LEVEL_MAX)
+    return lz4CompressHigh(src, LZ4_HIGH_ATTEMPTS_STEP * (level - LZ4_LEVEL_DEFAULT))
+
+
+def runJob(job):
+    # Functions are passed by name so workers look them up in this module
+    return globals()[job[0]](*job[1:])
+
+
+def runPool(jobs, workers):
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        # Blender before 2.91 reports its own binary as the executable
+        raise OSError('No Python executable to start workers: ' + sys.executable)
+    dirPath = os.path.dirname(os.path.abspath(__file__))
+    # Spawned workers copy sys.path, keep this folder on it while they start
+    sys.path.insert(0, dirPath)
+    try:
+        worker = importlib.import_module(WORKER_MODULE)
+        if os.path.dirname(os.path.abspath(worker.__file__)) != dirPath:
+            raise ImportError('Worker module shadowed by ' + worker.__file__)
+        # Spawn on every platform, forking Blender copies its running threads
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers = min(workers, len(jobs)),
+                                 mp_context = context) as pool:
+            return list(pool.map(worker.runJob, jobs))
+    finally:
+        sys.path.remove(dirPath)
+
+
+def compressJobs(jobs, workers = 1, warnings = None):
+    # Each job is a function name followed by its arguments
+    if workers > 1 and len(jobs) > 1:
+        try:
+            return runPool(jobs, workers)
+        except (BrokenProcessPool, ImportError, OSError) as e:
+            # Only a pool that failed to start runs the jobs serially
+            if warnings != None:
+                warnings.append('Compression Processes Failed, Compressed Serially: %s' % e)
+    return [runJob(job) for job in jobs]
+
+
+def lz4Compress(src, level = LZ4_LEVEL_DEFAULT, workers = 1, warnings = None):
     dst = bytearray()
     inputSize = len(src)
     if inputSize == 0:
@@ -189,36 +401,51 @@ def lz4Compress(src):
         print('Buffer Too Large for LZ4 Compression')
     elif inputSize <= MAX_BLOCK_INPUT_SIZE:
         dst.append(0)
-        dst += lz4CompressDefault(src)
+        dst += lz4CompressBlock(src, level)
     else:
         wholeChunks = inputSize // MAX_BLOCK_INPUT_SIZE
         partChunkSize = inputSize % MAX_BLOCK_INPUT_SIZE
         partChunk = 1 if partChunkSize > 0 else 0
         dst = (wholeChunks+partChunk).to_bytes(1, byteorder='little')
-        for i in range(wholeChunks):
+        jobs = []
+        for i in range(wholeChunks + partChunk):
             offset = i * MAX_BLOCK_INPUT_SIZE
             chunk = src[offset:offset+MAX_BLOCK_INPUT_SIZE]
-            chunk = lz4CompressDefault(chunk)
-            dst += (len(chunk)).to_bytes(4, byteorder='little')
-            dst += chunk
-        if partChunk == 1:
-            offset = wholeChunks * MAX_BLOCK_INPUT_SIZE
-            chunk = src[offset:]
-            chunk = lz4CompressDefault(chunk)
+            jobs.append(('lz4CompressBlock', chunk, level))
+        for chunk in compressJobs(jobs, workers, warnings):
             dst += (len(chunk)).to_bytes(4, byteorder='little')
             dst += chunk
     return dst
 
 
-def lz4DecompressChunk(src):
+def lz4CompressInt32(values, level = LZ4_LEVEL_DEFAULT):
+    return lz4Compress(usdInt32Compress(values), level)
+
+
+def copyMatch(dst, offset, matchLen):
+    if offset <= 0 or offset > len(dst):
+        raise ValueError('Invalid LZ4 match offset: %d' % offset)
+    start = len(dst) - offset
+    if offset >= matchLen:
+        # Match does not overlap the output head, copy it as one slice
+        dst += dst[start:start + matchLen]
+    else:
+        # Overlapping match repeats the last offset bytes, double the run
+        run = dst[start:]
+        while len(run) < matchLen:
+            run = run + run
+        dst += run[:matchLen]
+
+
+def lz4DecompressChunkPython(src):
     dst = bytearray()
     srcLen = len(src)
     srcPtr = 0
     while srcPtr < srcLen:
-        token = memoryview(src)[srcPtr:srcPtr +  1]
+        token = src[srcPtr]
         srcPtr += 1
         # Get Literal Length
-        litLen = (token[0] >> 4) & 0x0F
+        litLen = (token >> 4) & 0x0F
         if litLen == 15:
             while src[srcPtr] == 255:
                 litLen += 255
@@ -232,10 +459,10 @@ def lz4DecompressChunk(src):
         if srcPtr >= srcLen:
             break
         # Get match offset
-        offset = int.from_bytes(src[srcPtr:srcPtr + 2], 'little')
+        offset = src[srcPtr] | (src[srcPtr + 1] << 8)
         srcPtr += 2
         # Get match length
-        matchLen = token[0] & 0x0F
+        matchLen = token & 0x0F
         if matchLen == 15:
             while src[srcPtr] == 255:
                 matchLen += 255
@@ -244,11 +471,33 @@ def lz4DecompressChunk(src):
             srcPtr += 1
         matchLen += MIN_MATCH
         # Copy Match
-        for i in range(matchLen):
-            dst.append(dst[len(dst) - offset])
+        copyMatch(dst, offset, matchLen)
     return dst
 
 
+def lz4DecompressChunkNative(src):
+    # The block size is not stored, grow the output until it fits
+    srcLen = len(src)
+    maxSize = srcLen * 255 + 16
+    size = max(srcLen * 4, 0x10000)
+    while True:
+        try:
+            return lz4Block.decompress(src, uncompressed_size=min(size, maxSize),
+                                       return_bytearray=True)
+        except lz4Block.LZ4BlockError:
+            if size >= maxSize:
+                return None
+            size *= 4
+
+
+def lz4DecompressChunk(src):
+    if lz4Block != None:
+        dst = lz4DecompressChunkNative(src)
+        if dst != None:
+            return dst
+    return lz4DecompressChunkPython(src)
+
+
 def lz4Decompress(src):
     dst = bytearray()
     if len(src) > 0:
@@ -271,40 +520,38 @@ def lz4Decompress(src):
     return dst
 
 
-def usdInt32Compress(values):
-    values = values.copy()
+def usdIntCompressPython(values, widths):
     data = bytearray()
     if len(values) == 0:
         return data
+    deltas = []
     preValue = 0
-    for i in range(len(values)):
-        value = values[i]
-        values[i] = value - preValue
+    for value in values:
+        deltas.append(value - preValue)
         preValue = value
-    commonValue = Counter(values).most_common()[0][0]
-    data += commonValue.to_bytes(4, 'little', signed=True) + data
-    data += bytes((len(values) * 2 + 7) // 8)
-    for v in range(len(values)):
-        value = values[v]
-        i = v + 16
+    commonValue = Counter(deltas).most_common()[0][0]
+    data += commonValue.to_bytes(widths[2], 'little', signed=True)
+    codes = bytearray((len(deltas) * 2 + 7) // 8)
+    vints = bytearray()
+    for i, value in enumerate(deltas):
         if value != commonValue:
-            if value.bit_length() < 8:
-                data[i//4] |= 1 << ((i%4)*2)
-                data += value.to_bytes(1, 'little', signed=True)
-            elif value.bit_length() < 16:
-                data[i//4] |= 2 << ((i%4)*2)
-                data += value.to_bytes(2, 'little', signed=True)
+            bits = value.bit_length()
+            if bits < widths[0] * 8:
+                code = 1
+            elif bits < widths[1] * 8:
+                code = 2
             else:
-                data[i//4] |= 3 << ((i%4)*2)
-                data += value.to_bytes(4, 'little', signed=True)
-    return data
+                code = 3
+            codes[i//4] |= code << ((i%4)*2)
+            vints += value.to_bytes(widths[code-1], 'little', signed=True)
+    return data + codes + vints
 
 
-def usdInt32Decompress(data, numInts):
+def usdIntDecompressPython(data, numInts, widths):
     values = []
     numCodes = (numInts * 2 + 7) // 8
-    commonValue = int.from_bytes(data[:4], 'little', signed=True)
-    data = data[4:]
+    commonValue = int.from_bytes(data[:widths[2]], 'little', signed=True)
+    data = data[widths[2]:]
     codes = memoryview(data)[:numCodes]
     vints = memoryview(data)[numCodes:]
     preValue = 0
@@ -314,43 +561,94 @@ def usdInt32Decompress(data, numInts):
         code = (codes[cp//4] >> (cp%4)*2) & 0x3
         if code == 0:
             preValue += commonValue
-        elif code == 1:
-            preValue += int.from_bytes(vints[vp:vp+1], 'little', signed=True)
-            vp += 1
-        elif code == 2:
-            preValue += int.from_bytes(vints[vp:vp+2], 'little', signed=True)
-            vp += 2
         else:
-            preValue += int.from_bytes(vints[vp:vp+4], 'little', signed=True)
-            vp += 4
+            width = widths[code-1]
+            preValue += int.from_bytes(vints[vp:vp+width], 'little', signed=True)
+            vp += width
         values.append(preValue)
         cp += 1
     return values
 
 
-def usdInt64Decompress(data, numInts):
-    values = []
+def mostCommonNumpy(values):
+    # Ties go to the value seen first to match Counter.most_common
+    low = values.min()
+    if values.max() - low < (1 << 20):
+        counts = np.bincount(values - low)
+        counts = counts[values - low]
+    else:
+        unique, inverse, counts = np.unique(values, return_inverse=True,
+                                            return_counts=True)
+        counts = counts[inverse.reshape(-1)]
+    return int(values[np.argmax(counts == counts.max())])
+
+
+def usdIntCompressNumpy(values, widths):
+    if len(values) == 0:
+        return bytearray()
+    values = np.asarray(values, dtype=np.int64)
+    deltas = np.diff(values, prepend=0)
+    commonValue = mostCommonNumpy(deltas)
+    data = bytearray(commonValue.to_bytes(widths[2], 'little', signed=True))
+    # Pick the code for each value from the bits it needs
+    magnitude = np.where(deltas < 0, -deltas, deltas)
+    codes = np.where(magnitude < (1 << (widths[0] * 8 - 1)), 1,
+            np.where(magnitude < (1 << (widths[1] * 8 - 1)), 2, 3)).astype(np.uint8)
+    codes[deltas == commonValue] = 0
+    # Pack four 2 bit codes into each byte
+    packed = np.zeros(((len(codes) + 3) // 4) * 4, dtype=np.uint8)
+    packed[:len(codes)] = codes
+    packed = packed.reshape(-1, 4) << np.array([0, 2, 4, 6], dtype=np.uint8)
+    data += np.bitwise_or.reduce(packed, axis=1).tobytes()
+    # Keep the low bytes of each little endian value for its width
+    sizes = np.array((0,) + widths)[codes]
+    raw = deltas.astype('<i8').view(np.uint8).reshape(-1, 8)
+    data += raw[np.arange(8) < sizes[:, None]].tobytes()
+    return data
+
+
+def usdIntDecompressNumpy(data, numInts, widths):
+    if numInts == 0:
+        return np.zeros(0, dtype=np.int64)
     numCodes = (numInts * 2 + 7) // 8
-    commonValue = int.from_bytes(data[:8], 'little', signed=True)
-    data = data[8:]
-    codes = memoryview(data)[:numCodes]
-    vints = memoryview(data)[numCodes:]
-    preValue = 0
-    cp = 0
-    vp = 0
-    while cp < numInts:
-        code = (codes[cp//4] >> (cp%4)*2) & 0x3
-        if code == 0:
-            preValue += commonValue
-        elif code == 1:
-            preValue += int.from_bytes(vints[vp:vp+2], 'little', signed=True)
-            vp += 2
-        elif code == 2:
-            preValue += int.from_bytes(vints[vp:vp+4], 'little', signed=True)
-            vp += 4
-        else:
-            preValue += int.from_bytes(vints[vp:vp+8], 'little', signed=True)
-            vp += 8
-        values.append(preValue)
-        cp += 1
-    return values
+    commonValue = int.from_bytes(data[:widths[2]], 'little', signed=True)
+    buffer = np.frombuffer(data, dtype=np.uint8, offset=widths[2])
+    codes = buffer[:numCodes]
+    vints = buffer[numCodes:]
+    # Unpack the 2 bit codes
+    codes = (codes[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 0x3
+    codes = codes.reshape(-1)[:numInts]
+    sizes = np.array((0,) + widths)[codes]
+    offsets = np.cumsum(sizes) - sizes
+    deltas = np.full(numInts, commonValue, dtype=np.int64)
+    for code, width in enumerate(widths, 1):
+        index = np.nonzero(codes == code)[0]
+        if len(index) > 0:
+            gather = offsets[index][:, None] + np.arange(width)
+            raw = np.ascontiguousarray(vints[gather])
+            deltas[index] = raw.view('<i%d' % width).reshape(-1)
+    return np.cumsum(deltas)
+
+
+def usdInt32Compress(values):
+    if np != None and (len(values) >= NUMPY_MIN_INTS or isinstance(values, np.ndarray)):
+        return usdIntCompressNumpy(values, INT32_WIDTHS)
+    return usdIntCompressPython(values, INT32_WIDTHS)
+
+
+def usdInt32Decompress(data, numInts):
+    if np != None and numInts >= NUMPY_MIN_INTS:
+        return usdIntDecompressNumpy(data, numInts, INT32_WIDTHS).tolist()
+    return usdIntDecompressPython(data, numInts, INT32_WIDTHS)
+
+
+def usdInt64Compress(values):
+    if np != None and (len(values) >= NUMPY_MIN_INTS or isinstance(values, np.ndarray)):
+        return usdIntCompressNumpy(values, INT64_WIDTHS)
+    return usdIntCompressPython(values, INT64_WIDTHS)
+
+
+def usdInt64Decompress(data, numInts):
+    if np != None and numInts >= NUMPY_MIN_INTS:
+        return usdIntDecompressNumpy(data, numInts, INT64_WIDTHS).tolist()
+    return usdIntDecompressPython(data, numInts, INT64_WIDTHS)
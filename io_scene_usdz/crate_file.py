@@ -1,5 +1,13 @@
 import os
+import mmap
 import struct
+import hashlib
+from collections import OrderedDict
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 from io_scene_usdz.compression_utils import *
 from io_scene_usdz.value_types import *
 
@@ -7,6 +15,9 @@ ARRAY_BIT = (1 << 63)
 INLINE_BIT = (1 << 62)
 COMPRESSED_BIT = (1 << 61)
 PAYLOAD_MASK = (1 << 48) - 1
+WRITE_BUFFER_SIZE = 1 << 20
+DEDUP_CACHE_SIZE = 4096
+CRATE_HEADER_SIZE = 88
 
 def writeInt(file, value, size, byteorder='little', signed=False):
     file.write(value.to_bytes(size, byteorder=byteorder, signed=signed))
@@ -19,15 +30,28 @@ def writeDouble(file, value, byteorder='little'):
     packStr = '<d' if byteorder.lower() == 'little' else '>d'
     file.write(struct.pack(packStr, value))
 
+def packValues(values, format):
+    # Pack a whole array with a single call
+    if np != None and isinstance(values, np.ndarray):
+        return values.astype('<' + format, copy=False).tobytes()
+    return struct.pack('<%d%s' % (len(values), format), *values)
+
+def packVectors(vectors, format):
+    if np != None and isinstance(vectors, np.ndarray):
+        return vectors.astype('<' + format, copy=False).tobytes()
+    return packValues([f for v in vectors for f in v], format)
+
 def toSigned32(n):
     n = n & 0xffffffff
     return (n ^ 0x80000000) - 0x80000000
 
-def writeInt32Compressed(file, data):
-    buffer = lz4Compress(usdInt32Compress(data))
+def writeCompressedBuffer(file, buffer):
     writeInt(file, len(buffer), 8)
     file.write(buffer)
 
+def writeInt32Compressed(file, data, level = LZ4_LEVEL_DEFAULT):
+    writeCompressedBuffer(file, lz4CompressInt32(data, level))
+
 def writeToAlign(file, size):
     bufBytes = file.tell() % size
     if bufBytes > 0:
@@ -42,6 +66,18 @@ def readInt32Compressed(file, numInts):
     buffer = lz4Decompress(file.read(size))
     return usdInt32Decompress(buffer, numInts)
 
+def dataDigest(buffer):
+    if xxhash != None:
+        return xxhash.xxh3_128_digest(buffer)
+    return hashlib.blake2b(buffer, digest_size=16).digest()
+
+def digestKey(buffer, vType):
+    # Payloads are identified by their packed bytes instead of their values
+    return (dataDigest(buffer), len(buffer), vType)
+
+def packArray(values, format):
+    return len(values).to_bytes(8, byteorder='little') + packValues(values, format)
+
 def dataKey(data):
     if type(data) == list:
         return tuple(data)
@@ -51,12 +87,16 @@ def dataKey(data):
 def writeValue(file, value, vType):
     if type(value) == list:
         writeInt(file, len(value), 8)
-        for v in value:
-            writeValue(file, v, vType)
+        if vType.name[:3] == 'vec':
+            file.write(packVectors(value, vType.name[-1]))
+        elif vType.name[:6] == 'matrix':
+            rows = [row for matrix in value for row in matrix]
+            file.write(packVectors(rows, vType.name[-1]))
+        else:
+            for v in value:
+                writeValue(file, v, vType)
     elif vType.name[:6] == 'matrix':
-        packStr = '<'+vType.name[-2:]
-        for row in value:
-            file.write(struct.pack(packStr, *row))
+        file.write(packVectors(value, vType.name[-1]))
     elif vType.name[:3] == 'vec':
         packStr = '<'+vType.name[-2:]
         file.write(struct.pack(packStr, *value))
@@ -112,14 +152,66 @@ def makeIdentityMatrix(size):
     return tuple((0,)*i + (1,) + (0,)*(size-i-1) for i in range(size))
 
 
+class CrateBuffer:
+    """Buffered Writer for Crate File Data"""
+
+    def __init__(self, file, size = WRITE_BUFFER_SIZE):
+        self.file = file
+        self.size = size
+        self.buffer = bytearray()
+        self.offset = file.tell()
+        self.writes = 0
+
+    def tell(self):
+        return self.offset + len(self.buffer)
+
+    def write(self, data):
+        size = memoryview(data).nbytes
+        if size >= self.size:
+            # Large payloads go straight to the file instead of the buffer
+            self.flush()
+            self.file.write(data)
+            self.offset += size
+            self.writes += 1
+            return size
+        self.buffer += data
+        if len(self.buffer) >= self.size:
+            self.flush()
+        return size
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.file.write(self.buffer)
+            self.offset += len(self.buffer)
+            self.buffer = bytearray()
+            self.writes += 1
+
+    def seek(self, offset, whence = 0):
+        self.flush()
+        self.offset = self.file.seek(offset, whence)
+        return self.offset
+
+
 class CrateFile:
-    def __init__(self, file):
+    def __init__(self, file, compressionLevel = LZ4_LEVEL_DEFAULT,
+                 compressionWorkers = 1, bufferSize = WRITE_BUFFER_SIZE):
         self.file = file
+        self.bufferSize = bufferSize
+        self.writes = 0
+        # Levels outside the operator range have no faster or smaller setting
+        self.compressionLevel = max(LZ4_LEVEL_FAST, min(compressionLevel, LZ4_LEVEL_MAX))
+        self.compressionWorkers = compressionWorkers
+        self.warnings = []
         self.version = 6
         self.toc = []
         self.tokenMap = {}
         self.tokens = []
         self.strings = []
+        self.stringMap = {}
+        self.tokenLookups = 0
+        self.tokenHits = 0
+        self.stringLookups = 0
+        self.stringHits = 0
         self.fields = []
         self.reps = []
         self.repsMap = {}
@@ -127,30 +219,71 @@ class CrateFile:
         self.paths = []
         self.specs = []
         self.specsMap = {}
-        self.writenData = {}
+        self.writenData = OrderedDict()
+        self.dedupSize = DEDUP_CACHE_SIZE
         self.framesRef = -1
-
-    def addWritenData(self, data, vType, ref):
-        key = (dataKey(data), vType)
+        self.mapping = None
+        self.lazy = False
+        self.arrays = False
+        self.copyArrays = False
+        self.rootChildren = 0
+        self.rootPath = -1
+        self.pathItems = {}
+
+    def addWritenData(self, key, ref):
         self.writenData[key] = ref
+        if len(self.writenData) > self.dedupSize:
+            self.writenData.popitem(last=False)
 
-    def getDataRefrence(self, data, vType):
-        key = (dataKey(data), vType)
+    def getDataRefrence(self, key):
         if key in self.writenData:
+            self.writenData.move_to_end(key)
             return self.writenData[key]
         return -1
 
+    def writeData(self, buffer, vType):
+        # Write a packed payload once and return its file offset
+        key = digestKey(buffer, vType)
+        ref = self.getDataRefrence(key)
+        if ref < 0:
+            ref = self.file.tell()
+            self.addWritenData(key, ref)
+            self.file.write(buffer)
+        return ref
+
     def getTokenIndex(self, token):
+        self.tokenLookups += 1
         if not token in self.tokenMap:
             self.tokenMap[token] = len(self.tokens)
             self.tokens.append(token)
+        else:
+            self.tokenHits += 1
         return self.tokenMap[token]
 
     def getStringIndex(self, str):
         tokenIndex = self.getTokenIndex(str)
-        if not tokenIndex in self.strings:
+        self.stringLookups += 1
+        if not tokenIndex in self.stringMap:
+            self.stringMap[tokenIndex] = len(self.strings)
             self.strings.append(tokenIndex)
-        return self.strings.index(tokenIndex)
+        else:
+            self.stringHits += 1
+        return self.stringMap[tokenIndex]
+
+    def getInternStats(self):
+        # Deduplication of the token and string tables
+        tokenRate = self.tokenHits / self.tokenLookups if self.tokenLookups > 0 else 0.0
+        stringRate = self.stringHits / self.stringLookups if self.stringLookups > 0 else 0.0
+        return {
+            'tokens': len(self.tokens),
+            'tokenLookups': self.tokenLookups,
+            'tokenHits': self.tokenHits,
+            'tokenHitRate': tokenRate,
+            'strings': len(self.strings),
+            'stringLookups': self.stringLookups,
+            'stringHits': self.stringHits,
+            'stringHitRate': stringRate,
+        }
 
     def addFieldSet(self, fset):
         index = len(self.fsets)
@@ -182,13 +315,7 @@ class CrateFile:
             for token in data:
                 token = token.replace('"', '')
                 tokens.append(self.getTokenIndex(token))
-            ref = self.getDataRefrence(tokens, ValueType.token)
-            if ref < 0:
-                ref = self.file.tell()
-                self.addWritenData(tokens, ValueType.token, ref)
-                writeInt(self.file, len(tokens), 8)
-                for token in tokens:
-                    writeInt(self.file, token, 4)
+            ref = self.writeData(packArray(tokens, 'I'), ValueType.token)
             return self.addFieldItem(field, ValueType.token, True, False, False, ref)
         token = self.getTokenIndex(data.replace('"', ''))
         return self.addFieldItem(field, ValueType.token, False, True, False, token)
@@ -204,14 +331,8 @@ class CrateFile:
         for token in tokens:
             token = token.replace('"', '')
             data.append(self.getTokenIndex(token))
-        ref = self.getDataRefrence(data, ValueType.TokenVector)
-        if ref < 0:
-            ref = self.file.tell()
-            self.addWritenData(data, ValueType.TokenVector, ref)
-            writeInt(self.file, len(data), 8)
-            for token in data:
-                writeInt(self.file, token, 4)
-            self.file.write(bytes(4))
+        buffer = packArray(data, 'I') + bytes(4)
+        ref = self.writeData(buffer, ValueType.TokenVector)
         return self.addFieldItem(field, ValueType.TokenVector, False, False, False, ref)
 
     def addFieldPathListOp(self, field, pathIndex):
@@ -250,45 +371,34 @@ class CrateFile:
 
     def addFieldInt(self, field, data):
         field = self.getTokenIndex(field)
-        if type(data) == list:
+        if isArrayValue(data):
             compress = len(data) >= 16
-            ref = self.getDataRefrence(data, ValueType.int)
+            buffer = packArray(data, 'i')
+            key = digestKey(buffer, ValueType.int)
+            ref = self.getDataRefrence(key)
             if ref < 0:
                 ref = self.file.tell()
-                self.addWritenData(data, ValueType.int, ref)
-                writeInt(self.file, len(data), 8)
+                self.addWritenData(key, ref)
                 if compress:
-                    writeInt32Compressed(self.file, data)
+                    writeInt(self.file, len(data), 8)
+                    writeInt32Compressed(self.file, data, self.compressionLevel)
                 else:
-                    for i in data:
-                        writeInt(self.file, i, 4, signed=True)
+                    self.file.write(buffer)
             return self.addFieldItem(field, ValueType.int, True, False, compress, ref)
         return self.addFieldItem(field, ValueType.int, False, True, False, data)
 
     def addFieldFloat(self, field, data):
         field = self.getTokenIndex(field)
-        if type(data) == list:
-            ref = self.getDataRefrence(data, ValueType.float)
-            if ref < 0:
-                ref = self.file.tell()
-                self.addWritenData(data, ValueType.float, ref)
-                writeInt(self.file, len(data), 8)
-                for f in data:
-                    writeFloat(self.file, f)
+        if isArrayValue(data):
+            ref = self.writeData(packArray(data, 'f'), ValueType.float)
             return self.addFieldItem(field, ValueType.float, True, False, False, ref)
         data = int.from_bytes(struct.pack('<f', data), 'little')
         return self.addFieldItem(field, ValueType.float, False, True, False, data)
 
     def addFieldDouble(self, field, data):
         field = self.getTokenIndex(field)
-        if type(data) == list:
-            ref = self.getDataRefrence(data, ValueType.double)
-            if ref < 0:
-                ref = self.file.tell()
-                self.addWritenData(data, ValueType.double, ref)
-                writeInt(self.file, len(data), 8)
-                for d in data:
-                    writeDouble(self.file, d)
+        if isArrayValue(data):
+            ref = self.writeData(packArray(data, 'd'), ValueType.double)
             return self.addFieldItem(field, ValueType.double, True, False, False, ref)
         data = int.from_bytes(struct.pack('<f', data), 'little')
         return self.addFieldItem(field, ValueType.double, False, True, False, data)
@@ -296,14 +406,10 @@ class CrateFile:
     def addFieldVector(self, field, data, vType):
         field = self.getTokenIndex(field)
         packStr = '<'+vType.name[-2:]
-        if type(data) == list:
-            ref = self.getDataRefrence(data, vType)
-            if ref < 0:
-                ref = self.file.tell()
-                self.addWritenData(data, vType, ref)
-                writeInt(self.file, len(data), 8)
-                for v in data:
-                    self.file.write(struct.pack(packStr, *v))
+        if isArrayValue(data):
+            buffer = len(data).to_bytes(8, byteorder='little')
+            buffer += packVectors(data, packStr[-1])
+            ref = self.writeData(buffer, vType)
             return self.addFieldItem(field, vType, True, False, False, ref)
         if isWholeBytes(data):
             nBytes = 2 * len(data)
@@ -313,29 +419,21 @@ class CrateFile:
             data = int.from_bytes(data, 'little')
             return self.addFieldItem(field, vType, False, True, False, data)
         else:
-            ref = self.getDataRefrence(data, vType)
-            if ref < 0:
-                ref = self.file.tell()
-                self.addWritenData(data, vType, ref)
-                self.file.write(struct.pack(packStr, *data))
+            ref = self.writeData(struct.pack(packStr, *data), vType)
             return self.addFieldItem(field, vType, False, False, False, ref)
 
     def addFieldMatrix(self, field, data, vType):
         field = self.getTokenIndex(field)
-        ref = self.getDataRefrence(data, vType)
-        if ref < 0:
-            ref = self.file.tell()
-            self.addWritenData(data, vType, ref)
-            packStr = '<'+vType.name[-2:]
+        if isArrayValue(data):
+            rows = data
             if type(data) == list:
-                writeInt(self.file, len(data), 8)
-                for matrix in data:
-                    for row in matrix:
-                        self.file.write(struct.pack(packStr, *row))
-            else:
-                for row in data:
-                    self.file.write(struct.pack(packStr, *row))
-        if type(data) == list:
+                rows = [row for matrix in data for row in matrix]
+            buffer = len(data).to_bytes(8, byteorder='little')
+            buffer += packVectors(rows, vType.name[-1])
+        else:
+            buffer = packVectors(data, vType.name[-1])
+        ref = self.writeData(buffer, vType)
+        if isArrayValue(data):
             return self.addFieldItem(field, vType, True, False, False, ref)
         return self.addFieldItem(field, vType, False, False, False, ref)
 
@@ -354,10 +452,9 @@ class CrateFile:
         ref = self.file.tell()
         writeInt(self.file, len(data), 8)
         for key, value in data.items():
-            writeInt(self.file, self.getStringIndex(key), 4)
-            writeInt(self.file, 8, 8)
-            writeInt(self.file, self.getStringIndex(value), 4)
-            writeInt(self.file, 1074397184, 4)
+            key = self.getStringIndex(key)
+            value = self.getStringIndex(value)
+            self.file.write(struct.pack('<IQII', key, 8, value, 1074397184))
         return self.addFieldItem(field, ValueType.Dictionary, False, False, False, ref)
 
     def addFieldTimeSamples(self, field, data, vType):
@@ -391,18 +488,15 @@ class CrateFile:
             self.framesRef = reference
             writeInt(self.file, size, 8)
             writeInt(self.file, count, 8)
-            for frame in frames:
-                writeDouble(self.file, frame)
+            self.file.write(packValues(frames, 'd'))
             writeInt(self.file, reference + 8, 6)
             writeInt(self.file, ValueType.DoubleVector.value, 1)
             writeInt(self.file, 0, 1)
         writeInt(self.file, 8, 8)
         writeInt(self.file, count, 8)
-        for ref in refs:
-            #print((ref, vType.value, elem))
-            writeInt(self.file, ref, 6)
-            writeInt(self.file, vType.value, 1)
-            writeInt(self.file, elem, 1)
+        # Each time sample is a 6 byte reference, value type and element flag
+        reps = [ref | (vType.value << 48) | (elem << 56) for ref in refs]
+        self.file.write(packValues(reps, 'Q'))
         return self.addFieldItem(field, ValueType.TimeSamples, False, False, False, reference)
 
     def addField(self, field, value, vType = ValueType.UnregisteredValue):
@@ -454,78 +548,81 @@ class CrateFile:
         writeInt(self.file, tocOffset, 8)
         self.file.write(bytes(64))
 
+    def compressSections(self):
+        level = self.compressionLevel
+        tokens = bytearray()
+        for token in self.tokens:
+            tokens += token.encode() + b'\0'
+        self.tokensSize = len(tokens)
+        jobs = []
+        jobs.append(('lz4Compress', tokens, level))
+        jobs.append(('lz4CompressInt32', self.fields, level))
+        jobs.append(('lz4Compress', encodeInts(self.reps, 8), level))
+        jobs.append(('lz4CompressInt32', self.fsets, level))
+        for i in range(3):
+            jobs.append(('lz4CompressInt32', [path[i] for path in self.paths], level))
+        for i in range(3):
+            jobs.append(('lz4CompressInt32', [spec[i] for spec in self.specs], level))
+        # Buffers are independent so they can be compressed concurrently
+        buffers = compressJobs(jobs, self.compressionWorkers, self.warnings)
+        self.sectionBuffers = {
+            'TOKENS': buffers[0:1],
+            'FIELDS': buffers[1:3],
+            'FIELDSETS': buffers[3:4],
+            'PATHS': buffers[4:7],
+            'SPECS': buffers[7:10],
+        }
+
+    def writeSectionBuffers(self, name):
+        for buffer in self.sectionBuffers.pop(name):
+            writeCompressedBuffer(self.file, buffer)
+
     def writeTokensSection(self):
         start = self.file.tell()
         writeInt(self.file, len(self.tokens), 8)
-        buffer = bytearray()
-        for token in self.tokens:
-            buffer += token.encode() + b'\0'
-        writeInt(self.file, len(buffer), 8)
-        buffer = lz4Compress(buffer)
-        writeInt(self.file, len(buffer), 8)
-        self.file.write(buffer)
+        writeInt(self.file, self.tokensSize, 8)
+        self.writeSectionBuffers('TOKENS')
         size = self.file.tell() - start
         self.toc.append(('TOKENS', start, size))
 
     def writeStringsSection(self):
         start = self.file.tell()
         writeInt(self.file, len(self.strings), 8)
-        for i in self.strings:
-            writeInt(self.file, i, 4)
+        self.file.write(packValues(self.strings, 'I'))
         size = self.file.tell() - start
         self.toc.append(('STRINGS', start, size))
 
     def writeFieldsSection(self):
         start = self.file.tell()
         writeInt(self.file, len(self.fields), 8)
-        writeInt32Compressed(self.file, self.fields)
-        buffer = lz4Compress(encodeInts(self.reps, 8))
-        writeInt(self.file, len(buffer), 8)
-        self.file.write(buffer)
+        self.writeSectionBuffers('FIELDS')
         size = self.file.tell() - start
         self.toc.append(('FIELDS', start, size))
 
     def writeFieldSetsSection(self):
         start = self.file.tell()
         writeInt(self.file, len(self.fsets), 8)
-        writeInt32Compressed(self.file, self.fsets)
+        self.writeSectionBuffers('FIELDSETS')
         size = self.file.tell() - start
         self.toc.append(('FIELDSETS', start, size))
 
     def writePathsSection(self):
         start = self.file.tell()
-        paths = []
-        tokens = []
-        jumps = []
-        for path, token, jump in self.paths:
-            paths.append(path)
-            tokens.append(token)
-            jumps.append(jump)
         writeInt(self.file, len(self.paths), 8)
         writeInt(self.file, len(self.paths), 8)
-        writeInt32Compressed(self.file, paths)
-        writeInt32Compressed(self.file, tokens)
-        writeInt32Compressed(self.file, jumps)
+        self.writeSectionBuffers('PATHS')
         size = self.file.tell() - start
         self.toc.append(('PATHS', start, size))
 
     def writeSpecsSection(self):
         start = self.file.tell()
-        paths = []
-        fsets = []
-        types = []
-        for path, fset, type in self.specs:
-            paths.append(path)
-            fsets.append(fset)
-            types.append(type)
         writeInt(self.file, len(self.specs), 8)
-        writeInt32Compressed(self.file, paths)
-        writeInt32Compressed(self.file, fsets)
-        writeInt32Compressed(self.file, types)
+        self.writeSectionBuffers('SPECS')
         size = self.file.tell() - start
         self.toc.append(('SPECS', start, size))
 
     def writeSections(self):
+        self.compressSections()
         self.writeTokensSection()
         self.writeStringsSection()
         self.writeFieldsSection()
@@ -558,7 +655,7 @@ class CrateFile:
         fset = self.addFieldSet(fset)
         usdAtt.pathIndex = self.addSpec(fset, SpecType.Attribute)
         nameToken = self.getTokenIndex(usdAtt.name)
-        pathJump = usdAtt.getPathJump()
+        pathJump = usdAtt.pathJump
         self.addPath(usdAtt.pathIndex, nameToken, pathJump, True)
 
     def writeUsdRelationship(self, usdAtt):
@@ -570,7 +667,7 @@ class CrateFile:
         fset = self.addFieldSet(fset)
         usdAtt.pathIndex = self.addSpec(fset, SpecType.Relationship)
         nameToken = self.getTokenIndex(usdAtt.name)
-        pathJump = usdAtt.getPathJump()
+        pathJump = usdAtt.pathJump
         self.addPath(usdAtt.pathIndex, nameToken, pathJump, True)
 
     def writeUsdAttribute(self, usdAtt):
@@ -583,14 +680,14 @@ class CrateFile:
                 fset.append(self.addField('custom', True))
         for name, value in usdAtt.metadata.items():
             fset.append(self.addField(name, value))
-        if usdAtt.value != None:
+        if usdAtt.value is not None:
             fset.append(self.addField('default', usdAtt.value, usdAtt.valueType))
         if usdAtt.hasTimeSamples():
             fset.append(self.addFieldTimeSamples('timeSamples', usdAtt.frames, usdAtt.valueType.name))
         fset = self.addFieldSet(fset)
         usdAtt.pathIndex = self.addSpec(fset, SpecType.Attribute)
         nameToken = self.getTokenIndex(usdAtt.name)
-        pathJump = usdAtt.getPathJump()
+        pathJump = usdAtt.pathJump
         self.addPath(usdAtt.pathIndex, nameToken, pathJump, True)
 
     def writeUsdPrim(self, usdPrim):
@@ -616,7 +713,7 @@ class CrateFile:
         fset = self.addFieldSet(fset)
         usdPrim.pathIndex = self.addSpec(fset, SpecType.Prim)
         nameToken = self.getTokenIndex(usdPrim.name)
-        pathJump = usdPrim.getPathJump()
+        pathJump = usdPrim.pathJump
         # Add Prim Path
         self.addPath(usdPrim.pathIndex, nameToken, pathJump, False)
         # Write Prim Children
@@ -631,10 +728,7 @@ class CrateFile:
             else:
                 self.writeUsdAttribute(attribute)
 
-    def writeUsd(self, usdData):
-        usdData.updatePathIndices()
-        self.writeBootStrap()
-        # Add Root Metadata
+    def addRootFieldSet(self, usdData):
         fset = []
         for name, value in usdData.metadata.items():
             if type(value) is float:
@@ -644,18 +738,65 @@ class CrateFile:
         if len(usdData.children) > 0:
             tokens = [c.name for c in usdData.children]
             fset.append(self.addFieldTokenVector('primChildren', tokens))
-        fset = self.addFieldSet(fset)
+        return self.addFieldSet(fset)
+
+    def finishUsd(self):
+        # Finish Writing the Crate File
+        self.writeSections()
+        self.writeTableOfContents()
+        self.file.flush()
+        self.writes = self.file.writes
+        self.file = self.file.file
+
+    def writeUsd(self, usdData):
+        usdData.updatePathIndices()
+        # Collect the small value writes into large file writes
+        self.file = CrateBuffer(self.file, self.bufferSize)
+        self.writeBootStrap()
+        # Add Root Metadata
+        fset = self.addRootFieldSet(usdData)
         usdData.pathIndex = self.addSpec(fset, SpecType.PseudoRoot)
         # Add First Path
         nameToken = self.getTokenIndex('')
-        pathJump = usdData.getPathJump()
-        self.addPath(usdData.pathIndex, nameToken, pathJump, False)
+        self.addPath(usdData.pathIndex, nameToken, usdData.pathJump, False)
         # Write the Children
         for child in usdData.children:
             self.writeUsdPrim(child)
-        # Finish Writing the Crate File
-        self.writeSections()
-        self.writeTableOfContents()
+        self.finishUsd()
+
+    def beginUsd(self, usdData):
+        # Start a streamed file, the root spec is filled in by endUsd
+        self.file = CrateBuffer(self.file, self.bufferSize)
+        self.writeBootStrap()
+        self.rootChildren = 0
+        self.rootPath = -1
+        usdData.pathIndex = self.addSpec(-1, SpecType.PseudoRoot)
+        nameToken = self.getTokenIndex('')
+        self.addPath(usdData.pathIndex, nameToken, -1, False)
+
+    def writeUsdChildren(self, usdData):
+        # Write the new root prims and release their values
+        for child in usdData.children[self.rootChildren:]:
+            child.updatePathIndices(len(self.specs))
+            self.writeUsdPrim(child)
+            # Prims before the last root prim jump over their items
+            self.rootPath = child.pathIndex
+            path, token, jump = self.paths[self.rootPath]
+            self.paths[self.rootPath] = (path, token, child.itemCount + 1)
+            child.clearValues()
+        self.rootChildren = len(usdData.children)
+
+    def endUsd(self, usdData):
+        self.writeUsdChildren(usdData)
+        if self.rootPath >= 0:
+            path, token, jump = self.paths[self.rootPath]
+            self.paths[self.rootPath] = (path, token, -1)
+        fset = self.addRootFieldSet(usdData)
+        self.specs[usdData.pathIndex] = (usdData.pathIndex, fset, SpecType.PseudoRoot.value)
+        self.specsMap[usdData.pathIndex] = (fset, SpecType.PseudoRoot.value)
+        path, token, jump = self.paths[usdData.pathIndex]
+        self.paths[usdData.pathIndex] = (path, token, usdData.getPathJump())
+        self.finishUsd()
 
     def getFieldSetMetadata(self, fset):
         metadata = {}
@@ -663,8 +804,13 @@ class CrateFile:
         for field in fset:
             if field < len(self.reps):
                 name = self.getTokenStr(self.fields[field])
-                value = self.getRepValue(self.reps[field])
-                metadata[name] = value
+                rep = self.reps[field]
+                arrays = self.arrays and name == 'default'
+                if self.lazy and name in ('default', 'timeSamples') and not rep & INLINE_BIT:
+                    # Decode value payloads only when they are accessed
+                    metadata[name] = LazyValue(self.getRepValue, rep, arrays)
+                else:
+                    metadata[name] = self.getRepValue(rep, arrays)
         return metadata
 
 
@@ -695,6 +841,7 @@ class CrateFile:
                 metadata.pop('primChildren')
             prim.metadata = metadata
             prim.pathIndex = path
+            self.pathItems[path] = prim
             index += 1
             itemJump = jump
             while index < len(self.paths) and itemJump != -2:
@@ -709,6 +856,7 @@ class CrateFile:
                 value = value.replace('@', '')
             att = parent.createAttribute(name, value, valueType)
             att.pathIndex = path
+            self.pathItems[path] = att
             if att.valueType.name != valueTypeStr:
                 att.valueTypeStr = valueTypeStr
             if 'variability' in metadata and metadata.pop('variability') == 1:
@@ -717,19 +865,51 @@ class CrateFile:
                 att.addQualifier('custom')
             if 'timeSamples' in metadata:
                 att.frames = metadata.pop('timeSamples')
-            att.metadata = metadata
+            if len(metadata) > 0:
+                att.metadata = metadata
         elif specType == SpecType.Relationship:
             rel = parent.createAttribute(name)
             rel.pathIndex = path
+            self.pathItems[path] = rel
             rel.valueTypeStr = 'rel'
             if 'variability' in metadata and metadata.pop('variability') == 1:
                 rel.addQualifier('uniform')
             if 'custom' in metadata and metadata.pop('custom') == 1:
                 rel.addQualifier('custom')
-            rel.metadata = metadata
+            if len(metadata) > 0:
+                rel.metadata = metadata
         return (index + 1, jump)
 
-    def readUsd(self):
+    def mapFile(self):
+        if self.mapping == None and hasattr(self.file, 'getbuffer'):
+            # Buffers from usdz archives are viewed without a copy
+            self.mapping = self.file.getbuffer()
+        elif self.mapping == None:
+            try:
+                self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.file = self.mapping
+            except (AttributeError, OSError, ValueError):
+                # Streams without a file descriptor are read directly
+                self.mapping = None
+
+    def close(self):
+        if self.mapping != None:
+            try:
+                if type(self.mapping) is memoryview:
+                    self.mapping.release()
+                else:
+                    self.mapping.close()
+            except BufferError:
+                # Arrays still view the mapping, it is unmapped once they are freed
+                pass
+            self.mapping = None
+
+    def readUsd(self, lazy = False, arrays = False, copy = True):
+        self.lazy = lazy
+        self.arrays = arrays and np != None
+        # Without copies arrays view the mapping until the caller closes it
+        self.copyArrays = copy
+        self.mapFile()
         self.readTableOfContents()
         path, token, jump = self.paths[0]
         fset, spec = self.specsMap[path]
@@ -737,10 +917,14 @@ class CrateFile:
         data.metadata = self.getFieldSetMetadata(fset)
         if 'primChildren' in data.metadata:
             data.metadata.pop('primChildren')
+        self.pathItems = {}
         index = 1
         while index < len(self.paths):
             index, jump = self.readUsdItem(data, index)
+        data.pathMap = self.pathItems
         data.resolvePaths()
+        if not lazy and copy:
+            self.close()
         return data
 
     def getTableItem(self, sectionName):
@@ -759,7 +943,7 @@ class CrateFile:
     def readTokensSection(self):
         start, size = self.getTableItem('TOKENS')
         if start > 0 and size > 0:
-            self.file.seek(start+8)
+            self.file.seek(start+16)
             compressedSize = readInt(self.file, 8)
             buffer = bytearray(self.file.read(compressedSize))
             buffer = lz4Decompress(buffer)
@@ -776,7 +960,10 @@ class CrateFile:
         if start > 0 and size > 0:
             self.file.seek(start)
             numStrings = readInt(self.file, 8)
-            self.strings = [readInt(self.file, 4) for i in range(numStrings)]
+            self.strings = decodeInts(self.file.read(4*numStrings), numStrings, 4)
+            self.stringMap = {}
+            for index, tokenIndex in enumerate(self.strings):
+                self.stringMap.setdefault(tokenIndex, index)
 
     def readFieldsSection(self):
         start, size = self.getTableItem('FIELDS')
@@ -829,12 +1016,16 @@ class CrateFile:
     def readTableOfContents(self):
         self.toc = []
         self.seekTableOfContents()
+        tocStart = self.file.tell()
         numItems = readInt(self.file, 8)
         for i in range(0, numItems):
             name = self.file.read(16).decode('utf-8').rstrip('\0')
             start = readInt(self.file, 8)
             size = readInt(self.file, 8)
             self.toc.append((name, start, size))
+        # Reads stop short at the end, so check the table was all there
+        if self.file.tell() < tocStart + 8 + numItems * 32:
+            raise ValueError('Truncated crate table of contents')
         # Read Each Section
         self.readTokensSection()
         self.readStringsSection()
@@ -878,6 +1069,24 @@ class CrateFile:
     def readMatrix(self, size):
         return tuple(self.readDoubleVector(size) for i in range(size))
 
+    def readArray(self, dtype, count, shape):
+        # View the payload in place when the file is memory mapped
+        dtype = np.dtype(dtype)
+        offset = self.file.tell()
+        size = count * dtype.itemsize
+        if self.mapping != None:
+            array = np.frombuffer(self.mapping, dtype=dtype, count=count, offset=offset)
+            if self.copyArrays:
+                array = array.copy()
+        else:
+            array = np.frombuffer(self.file.read(size), dtype=dtype, count=count)
+        self.file.seek(offset + size)
+        return array.reshape((-1,) + shape)
+
+    def readArrayCount(self):
+        countBytes = 4 if self.version < 7 else 8
+        return readInt(self.file, countBytes)
+
     def readDictionary(self, loc):
         self.file.seek(loc)
         numItems = readInt(self.file, 8)
@@ -908,32 +1117,39 @@ class CrateFile:
     def decodeInlineFloatVector(payload, size):
         data = rep['payload'].to_bytes(4*size, byteorder='big')
 
-    def decodeRepFloatVector(self, rep, size):
+    def decodeRepFloatVector(self, rep, size, arrays = False):
         if rep['inline']:
             data = rep['payload'].to_bytes(8, byteorder='little')
             return tuple(float(data[i]) for i in range(size))
         self.file.seek(rep['payload'])
+        if rep['array'] and arrays:
+            return self.readArray('<f4', self.readArrayCount() * size, (size,))
         if rep['array']:
             countBytes = 4 if self.version < 7 else 8
             count = readInt(self.file, countBytes)
             return [self.readFloatVector(size) for i in range(count)]
         return self.readFloatVector(size)
 
-    def decodeRepDoubleVector(self, rep, size):
+    def decodeRepDoubleVector(self, rep, size, arrays = False):
         if rep['inline']:
             data = rep['payload'].to_bytes(8, byteorder='little')
             return tuple(float(data[i]) for i in range(size))
         self.file.seek(rep['payload'])
+        if rep['array'] and arrays:
+            return self.readArray('<f8', self.readArrayCount() * size, (size,))
         if rep['array']:
             countBytes = 4 if self.version < 7 else 8
             count = readInt(self.file, countBytes)
             return [self.readDoubleVector(size) for i in range(count)]
         return self.readDoubleVector(size)
 
-    def decodeRepMatrix(self, rep, size):
+    def decodeRepMatrix(self, rep, size, arrays = False):
         if rep['inline']:
             return makeIdentityMatrix(size)
         self.file.seek(rep['payload'])
+        if rep['array'] and arrays:
+            count = self.readArrayCount() * size * size
+            return self.readArray('<f8', count, (size, size))
         if rep['array']:
             countBytes = 4 if self.version < 7 else 8
             count = readInt(self.file, countBytes)
@@ -975,7 +1191,7 @@ class CrateFile:
         reps = self.readSampleReps(ref)
         return [(f, self.getRepValue(r)) for f, r in zip(frames, reps)]
 
-    def getRepValue(self, rep):
+    def getRepValue(self, rep, arrays = False):
         rep = decodeRep(rep)
         if rep['type'] == ValueType.token:
             if not rep['inline']:
@@ -1030,8 +1246,13 @@ class CrateFile:
             if rep['array']:
                 countBytes = 4 if self.version < 7 else 8
                 count = readInt(self.file, countBytes)
+                if rep['compressed'] and arrays:
+                    buffer = lz4Decompress(self.file.read(readInt(self.file, 8)))
+                    return usdIntDecompressNumpy(buffer, count, INT32_WIDTHS)
                 if rep['compressed']:
                     return readInt32Compressed(self.file, count)
+                if arrays:
+                    return self.readArray('<i4', count, ())
                 return [readInt(self.file, 4, signed=True) for i in range(count)]
             return readInt(self.file, 4, signed=True)
         elif rep['type'] == ValueType.float:
@@ -1041,6 +1262,8 @@ class CrateFile:
             if rep['array']:
                 countBytes = 4 if self.version < 7 else 8
                 count = readInt(self.file, countBytes)
+                if arrays:
+                    return self.readArray('<f4', count, ())
                 return list(struct.unpack('<%df'%count, self.file.read(4*count)))
             return struct.unpack('<f', self.file.read(4))
         elif rep['type'] == ValueType.double:
@@ -1050,26 +1273,28 @@ class CrateFile:
             if rep['array']:
                 countBytes = 4 if self.version < 7 else 8
                 count = readInt(self.file, countBytes)
+                if arrays:
+                    return self.readArray('<f8', count, ())
                 return list(struct.unpack('<%dd'%count, self.file.read(8*count)))
             return struct.unpack('<d', self.file.read(8))
         elif rep['type'] == ValueType.vec2f:
-            return self.decodeRepFloatVector(rep, 2)
+            return self.decodeRepFloatVector(rep, 2, arrays)
         elif rep['type'] == ValueType.vec3f:
-            return self.decodeRepFloatVector(rep, 3)
+            return self.decodeRepFloatVector(rep, 3, arrays)
         elif rep['type'] in (ValueType.vec4f, ValueType.quatf):
-            return self.decodeRepFloatVector(rep, 4)
+            return self.decodeRepFloatVector(rep, 4, arrays)
         elif rep['type'] == ValueType.vec2d:
-            return self.decodeRepDoubleVector(rep, 2)
+            return self.decodeRepDoubleVector(rep, 2, arrays)
         elif rep['type'] == ValueType.vec3d:
-            return self.decodeRepDoubleVector(rep, 3)
+            return self.decodeRepDoubleVector(rep, 3, arrays)
         elif rep['type'] in (ValueType.vec4d, ValueType.quatd):
-            return self.decodeRepDoubleVector(rep, 4)
+            return self.decodeRepDoubleVector(rep, 4, arrays)
         elif rep['type'] == ValueType.matrix2d:
-            return self.decodeRepMatrix(rep, 2)
+            return self.decodeRepMatrix(rep, 2, arrays)
         elif rep['type'] == ValueType.matrix3d:
-            return self.decodeRepMatrix(rep, 3)
+            return self.decodeRepMatrix(rep, 3, arrays)
         elif rep['type'] == ValueType.matrix4d:
-            return self.decodeRepMatrix(rep, 4)
+            return self.decodeRepMatrix(rep, 4, arrays)
         elif rep['type'] == ValueType.Dictionary:
             return self.readDictionary(rep['payload'])
         elif rep['type'] == ValueType.TimeSamples:
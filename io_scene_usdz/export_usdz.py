@@ -3,23 +3,72 @@ import os
 import subprocess
 import tempfile
 import shutil
+import struct
 import time
 
 try:
     import zlib
     crc32 = zlib.crc32
 except ImportError:
+    import binascii
     crc32 = binascii.crc32
 
 from io_scene_usdz.scene_data import *
 from io_scene_usdz.value_types import *
 from io_scene_usdz.crate_file import *
+from io_scene_usdz.mesh_cache import MeshCache
+
+COPY_BUFFER_SIZE = 1 << 20
+ZIP64_LIMIT = 0xffffffff
+ZIP64_ENTRY_LIMIT = 0xffff
+ZIP64_EXTRA_SIZE = 20
+PADDING_EXTRA_ID = 0x1986
+
+def zipField(value, limit = ZIP64_LIMIT):
+    # Values over the limit are stored in the ZIP64 fields instead
+    return min(value, limit)
+
+def gf2MatrixTimes(mat, vec):
+    sum = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            sum ^= mat[i]
+        vec >>= 1
+        i += 1
+    return sum
+
+def gf2MatrixSquare(mat):
+    return [gf2MatrixTimes(mat, mat[n]) for n in range(32)]
+
+def crc32Combine(crc1, crc2, len2):
+    # CRC of two joined buffers from their CRCs, as zlib crc32_combine
+    if len2 <= 0:
+        return crc1
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = gf2MatrixSquare(odd)
+    odd = gf2MatrixSquare(even)
+    while True:
+        even = gf2MatrixSquare(odd)
+        if len2 & 1:
+            crc1 = gf2MatrixTimes(even, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+        odd = gf2MatrixSquare(even)
+        if len2 & 1:
+            crc1 = gf2MatrixTimes(odd, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+    return crc1 ^ crc2
 
 def export_usdz(context, filepath = '', exportMaterials = True,
                 bakeTextures = False, bakeTextureSize = 1024, bakeAO = False,
                 bakeAOSamples = 64, exportAnimations = False,
                 globalScale = 1.0, useConverter = False,
-                ):
+                compressionLevel = LZ4_LEVEL_DEFAULT, compressionWorkers = 1,
+                maxInfluences = 0, meshCachePath = '', report = None):
     exportDir, fileName = os.path.split(filepath)
     fileParts = fileName.split('.')
     fileName = fileParts[0] if len(fileParts) > 0 else 'file'
@@ -29,6 +78,18 @@ def export_usdz(context, filepath = '', exportMaterials = True,
     if not fileType in ('usda', 'usdc'):
         tempDir = tempfile.mkdtemp()
         exportDir = tempDir
+    usdz = None
+    crateFile = None
+    crate = None
+    if fileType == 'usdc':
+        # Write the crate file while the scene is exported
+        crateFile = open(filePath, 'wb')
+    elif fileType != 'usda' and not useConverter:
+        # Write the crate straight into the usdz archive
+        usdz = UsdzFile(filePath)
+        crateFile = usdz.openEntry(fileName + '.usdc', CRATE_HEADER_SIZE)
+    if crateFile != None:
+        crate = CrateFile(crateFile, compressionLevel, compressionWorkers)
     usdData, texturePaths = exportUsdData(context = context,
                                           exportMaterials = exportMaterials,
                                           exportDir = exportDir,
@@ -37,31 +98,42 @@ def export_usdz(context, filepath = '', exportMaterials = True,
                                           bakeAO = bakeAO,
                                           bakeAOSamples = bakeAOSamples,
                                           exportAnimations = exportAnimations,
-                                          globalScale = globalScale)
+                                          globalScale = globalScale,
+                                          maxInfluences = maxInfluences,
+                                          meshCachePath = meshCachePath,
+                                          crate = crate)
+    warnings = []
+    if crateFile != None:
+        crateFile.close()
+        warnings = crate.warnings
     if fileType == 'usda':
         usdData.writeUsda(filePath)
-    elif fileType == 'usdc':
-        writeCrateFile(filePath, usdData)
-    else:
+    elif fileType != 'usdc':
         if useConverter:
             # Crate text usda file and run the USDZ Converter Tool
             usdaPath = tempDir + '/' + fileName + '.usda'
             usdData.writeUsda(usdaPath)
             convertToUsdz(filePath, usdaPath)
         else:
-            # Create Binary and Manually zip to a usdz file
-            usdcPath = tempDir + '/' + fileName + '.usdc'
-            writeCrateFile(usdcPath, usdData)
-            writeUsdzFile(filePath, usdcPath, texturePaths)
+            # Add the textures after the crate entry
+            for texturePath in texturePaths:
+                usdz.addFile(texturePath)
+            usdz.close()
     if tempDir != None:
         # Cleanup the Temp Directory
         shutil.rmtree(tempDir)
+    for warning in warnings:
+        if report != None:
+            report({'WARNING'}, warning)
+        else:
+            print(warning)
     return {'FINISHED'}
 
 
 def exportUsdData(context, exportMaterials, exportDir, bakeTextures,
                   bakeTextureSize, bakeAO, bakeAOSamples, exportAnimations,
-                  globalScale):
+                  globalScale, maxInfluences = 0, meshCachePath = '',
+                  crate = None):
     scene = Scene()
     scene.exportMaterials = exportMaterials
     scene.exportPath = exportDir
@@ -71,12 +143,16 @@ def exportUsdData(context, exportMaterials, exportDir, bakeTextures,
     scene.bakeSamples = bakeAOSamples
     scene.animated = exportAnimations
     scene.scale = globalScale
+    scene.maxInfluences = maxInfluences
+    if meshCachePath != '' and np != None:
+        # Reuse the mesh arrays of unchanged meshes from earlier exports
+        scene.meshCache = MeshCache(bpy.path.abspath(meshCachePath))
     scene.loadContext(context)
     # Export image files
     if scene.bakeTextures:
         scene.exportBakedTextures()
     # Export the USD Data
-    usdData = scene.exportUsd()
+    usdData = scene.exportUsd(crate)
     texturePaths = scene.textureFilePaths
     # Cleanup the scene
     scene.cleanup()
@@ -89,52 +165,128 @@ def convertToUsdz(filePath, usdaPath):
     subprocess.run(args)
 
 
-def writeUsdzFile(filePath, usdcPath, texturePaths):
-    usdz = UsdzFile(filePath)
-    usdz.addFile(usdcPath)
-    for texturePath in texturePaths:
-        usdz.addFile(texturePath)
-    usdz.close()
-
-
-def writeCrateFile(filePath, usdData):
+def writeCrateFile(filePath, usdData, compressionLevel = LZ4_LEVEL_DEFAULT,
+                   compressionWorkers = 1):
     crateFile = open(filePath, 'wb')
-    crate = CrateFile(crateFile)
+    crate = CrateFile(crateFile, compressionLevel, compressionWorkers)
     crate.writeUsd(usdData)
     crateFile.close()
+    return crate.warnings
+
 
+class UsdzEntryFile:
+    """Writable File Stream for a usdz Archive Entry"""
 
-def readFileContents(filePath):
-    file = open(filePath, 'rb')
-    contents = file.read()
-    file.close()
-    return contents
+    def __init__(self, usdz, name, headSize = 0):
+        self.usdz = usdz
+        self.entry = usdz.beginEntry(name)
+        self.start = usdz.file.tell()
+        # Header bytes may be rewritten so their CRC is added at the end
+        self.head = bytearray(headSize)
+        self.headSize = headSize
+        self.offset = 0
+        self.size = 0
+        self.crc = 0
+        self.sequential = True
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += self.size
+        self.offset = offset
+        return self.offset
+
+    def write(self, data):
+        view = memoryview(data)
+        if self.offset < self.headSize:
+            count = min(len(view), self.headSize - self.offset)
+            self.head[self.offset:self.offset + count] = view[:count]
+            view = view[count:]
+            self.offset += count
+            self.size = max(self.size, self.offset)
+        if len(view) > 0:
+            if self.offset != self.size:
+                self.sequential = False
+            else:
+                self.crc = crc32(view, self.crc)
+            file = self.usdz.file
+            if file.tell() != self.start + self.offset:
+                file.seek(self.start + self.offset)
+            file.write(view)
+            self.offset += len(view)
+            self.size = max(self.size, self.offset)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        file = self.usdz.file
+        head = bytes(self.head[:min(self.size, self.headSize)])
+        file.seek(self.start)
+        file.write(head)
+        if self.sequential:
+            crc = crc32Combine(crc32(head), self.crc, self.size - len(head))
+        else:
+            crc = self.usdz.readEntryCrc(self.start, self.size)
+        file.seek(self.start + self.size)
+        self.entry['crc'] = crc
+        self.entry['size'] = self.size
+        self.usdz.endEntry()
 
 
 class UsdzFile:
     def __init__(self, filePath):
-        self.file = open(filePath, 'wb')
+        self.file = open(filePath, 'w+b')
         self.entries = []
         self.cdOffset = 0
         self.cdLength = 0
 
-    def getExtraAlignmentSize(self, name):
-        return 64 - ((self.file.tell() + 30 + len(name) + 4) % 64)
+    def getExtraAlignmentSize(self, name, minSize = 1):
+        extraSize = 64 - ((self.file.tell() + 30 + len(name) + 4) % 64)
+        while extraSize < minSize:
+            extraSize += 64
+        return extraSize
 
     def addFile(self, filePath):
-        contents = readFileContents(filePath)
+        # Copy the file in chunks so textures are never fully loaded
+        self.beginEntry(os.path.basename(filePath), os.path.getsize(filePath))
+        file = open(filePath, 'rb')
+        chunk = file.read(COPY_BUFFER_SIZE)
+        while len(chunk) > 0:
+            self.writeEntryData(chunk)
+            chunk = file.read(COPY_BUFFER_SIZE)
+        file.close()
+        self.endEntry()
+
+    def addBuffer(self, name, buffer):
+        self.beginEntry(name, len(buffer))
+        self.writeEntryData(buffer)
+        self.endEntry()
+
+    def beginEntry(self, name, size = -1):
         entry = {}
-        entry['name'] = os.path.basename(filePath)
+        entry['name'] = name
         # File offset and crc32 hash
         entry['offset'] = self.file.tell()
-        entry['crc'] = crc32(contents) & 0xffffffff
+        entry['crc'] = 0
+        entry['size'] = 0
         # Write the Current Date and Time
         dt = time.localtime(time.time())
         dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
         dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
         entry['time'] = dosdate.to_bytes(2, byteorder = 'little')
         entry['date'] = dostime.to_bytes(2, byteorder = 'little')
-        extraSize = self.getExtraAlignmentSize(entry['name'])
+        # Reserve room for a ZIP64 field when the size is unknown
+        minSize = 1
+        if size < 0 or size >= ZIP64_LIMIT:
+            minSize = ZIP64_EXTRA_SIZE
+        extraSize = self.getExtraAlignmentSize(entry['name'], minSize)
+        entry['extraSize'] = extraSize
         # Local Entry Signature
         self.file.write(b'\x50\x4b\x03\x04')
         # Version for Extract, Bits, Compression Method
@@ -144,11 +296,10 @@ class UsdzFile:
         # Mod Time/Date
         self.file.write(entry['time'])
         self.file.write(entry['date'])
-        # CRC Hash
-        writeInt(self.file, entry['crc'], 4)
-        # Size Uncompressed/Compressed
-        writeInt(self.file, len(contents), 4)
-        writeInt(self.file, len(contents), 4)
+        # CRC Hash and Sizes are patched in endEntry
+        writeInt(self.file, 0, 4)
+        writeInt(self.file, 0, 4)
+        writeInt(self.file, 0, 4)
         # Filename/Extra Length
         writeInt(self.file, len(entry['name']), 2)
         writeInt(self.file, extraSize+4, 2)
@@ -157,21 +308,80 @@ class UsdzFile:
         # Extra Header Id/Size
         writeInt(self.file, 1, 2)
         writeInt(self.file, extraSize, 2)
-        # Padding Bytes and File Contents
+        # Padding Bytes
         self.file.write(bytes(extraSize))
-        self.file.write(contents)
-        entry['size'] = len(contents)
         self.entries.append(entry)
+        return entry
+
+    def writeEntryData(self, data):
+        entry = self.entries[-1]
+        entry['crc'] = crc32(data, entry['crc'])
+        entry['size'] += len(data)
+        self.file.write(data)
+
+    def openEntry(self, name, headSize = 0):
+        return UsdzEntryFile(self, name, headSize)
+
+    def readEntryCrc(self, start, size):
+        # Entries written out of order are hashed from the file
+        crc = 0
+        self.file.seek(start)
+        while size > 0:
+            chunk = self.file.read(min(size, COPY_BUFFER_SIZE))
+            crc = crc32(chunk, crc)
+            size -= len(chunk)
+        return crc
+
+    def endEntry(self):
+        entry = self.entries[-1]
+        entry['crc'] &= 0xffffffff
+        end = self.file.tell()
+        # Patch the CRC Hash and Size Uncompressed/Compressed
+        self.file.seek(entry['offset'] + 14)
+        writeInt(self.file, entry['crc'], 4)
+        writeInt(self.file, zipField(entry['size']), 4)
+        writeInt(self.file, zipField(entry['size']), 4)
+        if entry['size'] >= ZIP64_LIMIT:
+            self.writeLocalZip64Extra(entry)
+        self.file.seek(end)
+
+    def writeLocalZip64Extra(self, entry):
+        if entry['extraSize'] < ZIP64_EXTRA_SIZE:
+            print('No room for ZIP64 sizes in', entry['name'])
+            return
+        # Version for Extract
+        self.file.seek(entry['offset'] + 4)
+        writeInt(self.file, 45, 2)
+        # Split the padding into ZIP64 sizes and the remaining padding
+        self.file.seek(entry['offset'] + 30 + len(entry['name']))
+        writeInt(self.file, 1, 2)
+        writeInt(self.file, 16, 2)
+        writeInt(self.file, entry['size'], 8)
+        writeInt(self.file, entry['size'], 8)
+        writeInt(self.file, PADDING_EXTRA_ID, 2)
+        writeInt(self.file, entry['extraSize'] - ZIP64_EXTRA_SIZE, 2)
+
+    def getCentralZip64Extra(self, entry):
+        values = []
+        if entry['size'] >= ZIP64_LIMIT:
+            values += [entry['size'], entry['size']]
+        if entry['offset'] >= ZIP64_LIMIT:
+            values.append(entry['offset'])
+        if len(values) == 0:
+            return b''
+        extra = struct.pack('<HH', 1, 8 * len(values))
+        return extra + struct.pack('<%dQ' % len(values), *values)
 
     def writeCentralDir(self):
         self.cdOffset = self.file.tell()
         for entry in self.entries:
+            extra = self.getCentralZip64Extra(entry)
             # Central Directory Signature
             self.file.write(b'\x50\x4B\x01\x02')
             # Version Made By
             writeInt(self.file, 62, 2)
             # Version For Extract
-            writeInt(self.file, 20, 2)
+            writeInt(self.file, 45 if len(extra) > 0 else 20, 2)
             # Bits
             writeInt(self.file, 0, 2)
             # Compression Method
@@ -181,35 +391,66 @@ class UsdzFile:
             # CRC Hash
             writeInt(self.file, entry['crc'], 4)
             # Size Compressed/Uncompressed
-            writeInt(self.file, entry['size'], 4)
-            writeInt(self.file, entry['size'], 4)
+            writeInt(self.file, zipField(entry['size']), 4)
+            writeInt(self.file, zipField(entry['size']), 4)
             # Filename Length, Extra Field Length, Comment Length
             writeInt(self.file, len(entry['name']), 2)
-            writeInt(self.file, 0, 2)
+            writeInt(self.file, len(extra), 2)
             writeInt(self.file, 0, 2)
             # Disk Number Start, Internal Attrs, External Attrs
             writeInt(self.file, 0, 2)
             writeInt(self.file, 0, 2)
             writeInt(self.file, 0, 4)
             # Local Header Offset
-            writeInt(self.file, entry['offset'], 4)
-            # Add the file name again
+            writeInt(self.file, zipField(entry['offset']), 4)
+            # Add the file name again and the ZIP64 fields
             self.file.write(entry['name'].encode())
+            self.file.write(extra)
             # Get Central Dir Length
         self.cdLength = self.file.tell() - self.cdOffset
 
+    def needsZip64(self):
+        if len(self.entries) >= ZIP64_ENTRY_LIMIT:
+            return True
+        return self.cdLength >= ZIP64_LIMIT or self.cdOffset >= ZIP64_LIMIT
+
+    def writeZip64EndCentralDir(self):
+        endOffset = self.file.tell()
+        # ZIP64 End Central Directory Signature and Record Size
+        self.file.write(b'\x50\x4B\x06\x06')
+        writeInt(self.file, 44, 8)
+        # Version Made By, Version For Extract
+        writeInt(self.file, 62, 2)
+        writeInt(self.file, 45, 2)
+        # Disk Number and Disk Number for Central Dir
+        writeInt(self.file, 0, 4)
+        writeInt(self.file, 0, 4)
+        # Num Central Dir Entries on Disk and Num Central Dir Entries
+        writeInt(self.file, len(self.entries), 8)
+        writeInt(self.file, len(self.entries), 8)
+        # Central Dir Length/Offset
+        writeInt(self.file, self.cdLength, 8)
+        writeInt(self.file, self.cdOffset, 8)
+        # ZIP64 End Central Directory Locator
+        self.file.write(b'\x50\x4B\x06\x07')
+        writeInt(self.file, 0, 4)
+        writeInt(self.file, endOffset, 8)
+        writeInt(self.file, 1, 4)
+
     def writeEndCentralDir(self):
+        if self.needsZip64():
+            self.writeZip64EndCentralDir()
         # End Central Directory Signature
         self.file.write(b'\x50\x4B\x05\x06')
         # Disk Number and Disk Number for Central Dir
         writeInt(self.file, 0, 2)
         writeInt(self.file, 0, 2)
         # Num Central Dir Entries on Disk and Num Central Dir Entries
-        writeInt(self.file, len(self.entries), 2)
-        writeInt(self.file, len(self.entries), 2)
+        writeInt(self.file, zipField(len(self.entries), ZIP64_ENTRY_LIMIT), 2)
+        writeInt(self.file, zipField(len(self.entries), ZIP64_ENTRY_LIMIT), 2)
         # Central Dir Length/Offset
-        writeInt(self.file, self.cdLength, 4)
-        writeInt(self.file, self.cdOffset, 4)
+        writeInt(self.file, zipField(self.cdLength), 4)
+        writeInt(self.file, zipField(self.cdOffset), 4)
         # Comment Length
         writeInt(self.file, 0, 2)
 
@@ -1,9 +1,9 @@
 import bpy
 import os
+import struct
 import subprocess
 import tempfile
 import shutil
-import zipfile
 import bmesh
 import mathutils
 import math
@@ -12,65 +12,70 @@ from io_scene_usdz.scene_data import *
 from io_scene_usdz.object_utils import *
 from io_scene_usdz.material_utils import *
 from io_scene_usdz.crate_file import *
+from io_scene_usdz.usda_file import *
+from io_scene_usdz.usdz_file import *
+
+# Errors the crate and usda readers raise on malformed or truncated files
+USD_PARSE_ERRORS = (ValueError, KeyError, IndexError, EOFError, struct.error)
 
 
 def import_usdz(context, filepath = '', materials = True, animations = True):
     filePath, fileName = os.path.split(filepath)
     fileName, fileType = fileName.split('.')
+    usdData = None
     if fileType == 'usdz':
-        with zipfile.ZipFile(filepath, 'r') as zf:
-            # Create a temp directory to extract to
-            tempPath = tempfile.mkdtemp()
-            try:
-                zf.extractall(tempPath)
-            except Exception as e:
-                print(e)
-            zf.close()
-            # Find the usdc file
-            usdcFile = findUsdz(tempPath)
+        # Read the archive in place instead of extracting it
+        archive = UsdzReader(filepath)
+        try:
+            usdcFile = archive.findFile('usdc')
+            if usdcFile == '':
+                usdcFile = archive.findFile('usda')
             if usdcFile != '':
-                file = open(usdcFile, 'rb')
-                crate = CrateFile(file)
-                usdData = crate.readUsd()
-                file.close()
-                print(usdData.toString(debug = True))
-                tempDir = usdcFile[:usdcFile.rfind('/')+1]
-                importData(context, usdData, tempDir, materials, animations)
+                file = archive.openFile(usdcFile)
+                usdData = importUsdFile(context, usdcFile, file, materials, animations, archive)
             else:
                 print('No usdc file found')
-            # Cleanup Temp Files
-            if tempPath != None:
-                shutil.rmtree(tempPath)
-    elif fileType == 'usdc':
-        usdcFile = filepath
-        file = open(usdcFile, 'rb')
-        crate = CrateFile(file)
-        usdData = crate.readUsd()
-        file.close()
-        print(usdData.toString(debug = True))
-        tempDir = usdcFile[:usdcFile.rfind('/')+1]
-        importData(context, usdData, tempDir, materials, animations)
+        finally:
+            # Textures and crate arrays view the archive until the import is done
+            archive.close()
+    elif fileType == 'usdc' or fileType == 'usda':
+        file = open(filepath, 'rb')
+        usdData = importUsdFile(context, filepath, file, materials, animations)
+    if usdData == None:
+        return {'CANCELLED'}
     return {'FINISHED'}
 
 
-def findUsdz(dirpath):
-    files = os.listdir(dirpath)
-    dirs = []
-    for file in files:
-        parts = file.split('.')
-        filepath = dirpath + '/' + file
-        if os.path.isdir(filepath):
-            dirs.append(filepath)
-        elif len(parts) > 0 and parts[-1] == 'usdc':
-            return filepath
-    for dir in dirs:
-        file = findUsdz(dir)
-        if file != '':
-            return file
-    return ''
-
-
-def importData(context, usdData, tempDir, materials, animated):
+def importUsdFile(context, filepath, file, materials, animations, archive = None):
+    if filepath.split('.')[-1] == 'usda':
+        reader = UsdaFile(file)
+    else:
+        reader = CrateFile(file)
+    try:
+        usdData = readUsdFile(reader)
+        if usdData != None:
+            print(usdData.toString(debug = True))
+            tempDir = filepath[:filepath.rfind('/')+1]
+            importData(context, usdData, tempDir, materials, animations, archive)
+    finally:
+        # Crate arrays view the mapped file until the import is done
+        reader.close()
+        file.close()
+    return usdData
+
+
+def readUsdFile(reader):
+    try:
+        if type(reader) is UsdaFile:
+            return reader.readUsd(arrays = True)
+        return reader.readUsd(arrays = True, copy = False)
+    except USD_PARSE_ERRORS as e:
+        # Nothing is imported from a file that failed to parse
+        print('Usd Parse Error:', e)
+    return None
+
+
+def importData(context, usdData, tempDir, materials, animated, archive = None):
     if animated:
         if 'startTimeCode' in usdData.metadata:
             context.scene.frame_start = usdData['startTimeCode']
@@ -78,7 +83,7 @@ def importData(context, usdData, tempDir, materials, animated):
             context.scene.frame_end = usdData['endTimeCode']
         if 'timeCodesPerSecond' in usdData.metadata:
             context.scene.render.fps = usdData['timeCodesPerSecond']
-    materials = importMaterials(usdData, tempDir) if materials else {}
+    materials = importMaterials(usdData, tempDir, archive) if materials else {}
     objects = getObjects(usdData)
     for object in objects:
         addObject(context, object, materials, animated = animated)
@@ -315,29 +320,75 @@ def addMaterial(obj, rel, materials):
     return 0
 
 
+def valueToList(value):
+    # Values are only NumPy arrays when numpy is installed
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return list(value)
+
+
+def addMeshVertices(mesh, verts):
+    # Append the points in bulk instead of one BMVert at a time
+    base = len(mesh.vertices)
+    if np == None:
+        mesh.vertices.add(len(verts))
+        for i, vert in enumerate(verts):
+            mesh.vertices[base + i].co = vert
+        return base
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1)
+    coords = np.empty(base * 3 + len(verts), dtype=np.float32)
+    mesh.vertices.foreach_get('co', coords[:base * 3])
+    coords[base * 3:] = verts
+    mesh.vertices.add(len(verts) // 3)
+    mesh.vertices.foreach_set('co', coords)
+    return base
+
+
+def addMeshUvs(mesh, uvName, uvs, numFaces):
+    # Fill the loops of the added faces in one pass
+    layer = mesh.uv_layers[uvName]
+    if np == None:
+        start = mesh.polygons[len(mesh.polygons) - numFaces].loop_start
+        for i in range(start, len(mesh.loops)):
+            index = i - start
+            layer.data[i].uv = uvs[index] if index < len(uvs) else (0.0, 0.0)
+        return
+    coords = np.zeros(len(mesh.loops) * 2, dtype=np.float32)
+    layer.data.foreach_get('uv', coords)
+    start = mesh.polygons[len(mesh.polygons) - numFaces].loop_start * 2
+    uvs = np.asarray(uvs, dtype=np.float32).reshape(-1)[:len(coords) - start]
+    coords[start:] = 0.0
+    coords[start:start + len(uvs)] = uvs
+    layer.data.foreach_set('uv', coords)
+
+
 def addMesh(obj, data, uvs, materials):
     # Get Geometry From Data
-    counts = data['faceVertexCounts'].value
-    indices = data['faceVertexIndices'].value
+    counts = valueToList(data['faceVertexCounts'].value)
+    indices = valueToList(data['faceVertexIndices'].value)
     verts = data['points'].value
     normals = None
     if 'primvars:normals:indices' in data:
-        normals = data['primvars:normals:indices'].value
+        normals = valueToList(data['primvars:normals:indices'].value)
     uvMaps = {}
     for uv in uvs:
         uvPrim = 'primvars:'+uv
-        if uvPrim in data and uvPrim+':indices' in data:
+        if uvPrim in data and uvPrim+':indices' in data and np == None:
             uvCoords = data[uvPrim].value
             uvIndices = data[uvPrim+':indices'].value
             uvMaps[uv] = [uvCoords[i] for i in uvIndices]
+        elif uvPrim in data and uvPrim+':indices' in data:
+            uvCoords = np.asarray(data[uvPrim].value, dtype=np.float32)
+            uvIndices = np.asarray(data[uvPrim+':indices'].value, dtype=np.int64)
+            uvMaps[uv] = uvCoords[uvIndices]
     # Compile Faces
     faces = []
     smooth = []
     index = 0
     for count in counts:
-        faces.append(tuple([indices[index + i] for i in range(count)]))
+        faces.append(tuple(indices[index:index + count]))
         if normals != None:
-            smooth.append(len(set(normals[index + i] for i in range(count))) > 1)
+            smooth.append(len(set(normals[index:index + count])) > 1)
         else:
             smooth.append(True)
         index += count
@@ -354,15 +405,13 @@ def addMesh(obj, data, uvs, materials):
             indices = geomSubset['indices']
             if rel != None and indices != None:
                 index = addMaterial(obj, rel, materials)
-                matSubsets.append((index, indices.value))
+                matSubsets.append((index, valueToList(indices.value)))
+    # Add the Vertices
+    vBase = addMeshVertices(obj.data, verts)
     # Create BMesh from Mesh Object
     bm = bmesh.new()
     bm.from_mesh(obj.data)
-    # Add the Vertices
-    vBase = len(bm.verts)
     fBase = len(bm.faces)
-    for vert in verts:
-        bm.verts.new(vert)
     bm.verts.ensure_lookup_table()
     # Add the Faces
     ordered = set()
@@ -380,20 +429,14 @@ def addMesh(obj, data, uvs, materials):
             fIndex = i + fBase
             if fIndex < len(bm.faces):
                 bm.faces[fIndex].material_index = matIndex
-    # Add the UVs
-    for uvName, uvs in uvMaps.items():
-        uvIndex = bm.loops.layers.uv[uvName]
-        index = 0
-        for f in bm.faces[-len(faces):]:
-            for i, l in enumerate(f.loops):
-                if index+i < len(uvs):
-                    l[uvIndex].uv = uvs[index + i]
-                else:
-                    l[uvIndex].uv = (0.0, 0.0)
-            index += len(f.loops)
     # Apply BMesh back to Mesh Object
     bm.to_mesh(obj.data)
     bm.free()
+    # Add the UVs
+    numFaces = min(len(faces), len(obj.data.polygons))
+    if numFaces > 0:
+        for uvName, uvs in uvMaps.items():
+            addMeshUvs(obj.data, uvName, uvs, numFaces)
 
 
 def applyBoneWeights(obj, data):
@@ -401,12 +444,32 @@ def applyBoneWeights(obj, data):
     weights = data['primvars:skel:jointWeights']
     if indices != None and weights != None:
         elementSize = weights['elementSize']
-        base = len(obj.data.vertices) - int(len(indices.value)/elementSize)
-        for i, weight in enumerate(zip(indices.value, weights.value)):
-            bone, weight = weight
-            if weight > 0.0:
-                index = base + i//elementSize
-                obj.vertex_groups[bone].add([index], weight, 'REPLACE')
+        if np == None:
+            base = len(obj.data.vertices) - len(indices.value) // elementSize
+            for i, weight in enumerate(zip(indices.value, weights.value)):
+                bone, weight = weight
+                if weight > 0.0:
+                    obj.vertex_groups[bone].add([base + i // elementSize], weight, 'REPLACE')
+            return
+        bones = np.asarray(indices.value, dtype=np.int64)
+        values = np.asarray(weights.value, dtype=np.float32)
+        base = len(obj.data.vertices) - len(bones) // elementSize
+        vertices = base + np.arange(len(bones)) // elementSize
+        used = values > 0.0
+        bones = bones[used]
+        values = values[used]
+        vertices = vertices[used]
+        # Add every vertex sharing a bone and weight in a single call
+        order = np.lexsort((values, bones))
+        bones = bones[order]
+        values = values[order]
+        vertices = vertices[order]
+        splits = np.nonzero((np.diff(bones) != 0) | (np.diff(values) != 0))[0] + 1
+        for group in np.split(np.arange(len(bones)), splits):
+            if len(group) > 0:
+                bone = int(bones[group[0]])
+                weight = float(values[group[0]])
+                obj.vertex_groups[bone].add(vertices[group].tolist(), weight, 'REPLACE')
 
 
 def getObjects(data):
@@ -433,19 +496,20 @@ def getMeshes(data):
     return meshes
 
 
-def importMaterials(data, tempDir):
+def importMaterials(data, tempDir, archive = None):
     materialMap = {}
     materials = data.getAllMaterials()
     for matData in materials:
-        mat = createMaterial(matData, tempDir)
+        mat = createMaterial(matData, tempDir, archive)
         materialMap[matData.name] = mat
     return materialMap
 
 
-def createMaterial(usdMat, tempDir):
+def createMaterial(usdMat, tempDir, archive = None):
     mat = bpy.data.materials.new(usdMat.name)
     mat.use_nodes = True
     data = {'usdMat':usdMat, 'tempDir':tempDir, 'material':mat}
+    data['archive'] = archive
     data['textureNodes'] = {}
     data['uvMapNodes'] = {}
     data['outputNode'] = getBpyOutputNode(mat)
@@ -540,14 +604,37 @@ def getImageTextureNode(data, usdTexture):
     texNode = data['material'].node_tree.nodes.new('ShaderNodeTexImage')
     texNode.location.x = -600.0
     texNode.location.y = posY
-    texNode.image = bpy.data.images.load(filePath)
-    texNode.image.pack()
+    texNode.image = loadImage(filePath, data['archive'])
     mapNode = getTextureMappingNode(data, usdTexture)
     data['material'].node_tree.links.new(texNode.inputs[0], mapNode.outputs[0])
     data['textureNodes'][usdTexture.name] = texNode
     return texNode
 
 
+def loadImage(filePath, archive = None):
+    if archive == None:
+        image = bpy.data.images.load(filePath)
+        image.pack()
+        return image
+    buffer = archive.getFileBuffer(filePath)
+    if buffer == None:
+        print('Texture not found:', filePath)
+        return None
+    try:
+        # Pack the image straight from the archive
+        image = bpy.data.images.new(os.path.basename(filePath), 8, 8)
+        image.pack(data = bytes(buffer), data_len = len(buffer))
+        image.source = 'FILE'
+    except TypeError:
+        # Older versions can only load images from a path
+        bpy.data.images.remove(image)
+        tempPath = tempfile.mkdtemp()
+        image = bpy.data.images.load(archive.extractFile(filePath, tempPath))
+        image.pack()
+        shutil.rmtree(tempPath)
+    return image
+
+
 def connectTextureToValueInput(data, texNode, input):
     texNode.image.colorspace_settings.name = 'Non-Color'
     # Add a Seperate Color Node
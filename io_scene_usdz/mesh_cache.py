@@ -0,0 +1,122 @@
+import os
+import bpy
+import hashlib
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from io_scene_usdz.object_utils import getBpyArray
+
+CACHE_VERSION = 1
+CACHE_EXTENSION = '.npz'
+SUBSET_PREFIX = 'subset:'
+
+
+def hashBpyArray(hash, collection, attribute, dtype, size = 1):
+    hash.update(attribute.encode('utf-8'))
+    hash.update(getBpyArray(collection, attribute, dtype, size).tobytes())
+
+
+def hashBpyValue(hash, value):
+    # Pointers are hashed by name and arrays by their items
+    if hasattr(value, 'name'):
+        value = value.name
+    elif isinstance(value, set):
+        value = tuple(sorted(value))
+    elif hasattr(value, '__len__') and not isinstance(value, str):
+        value = tuple(value)
+    hash.update(repr(value).encode('utf-8'))
+
+
+def hashBpyModifier(hash, modifier):
+    hash.update(modifier.type.encode('utf-8'))
+    for prop in modifier.bl_rna.properties:
+        if prop.identifier != 'rna_type' and prop.type != 'COLLECTION':
+            hash.update(prop.identifier.encode('utf-8'))
+            hashBpyValue(hash, getattr(modifier, prop.identifier, None))
+
+
+def hashBpyMesh(hash, mesh):
+    hashBpyArray(hash, mesh.vertices, 'co', np.float32, 3)
+    hashBpyArray(hash, mesh.loops, 'vertex_index', np.int32)
+    hashBpyArray(hash, mesh.polygons, 'loop_start', np.int32)
+    hashBpyArray(hash, mesh.polygons, 'loop_total', np.int32)
+    hashBpyArray(hash, mesh.polygons, 'material_index', np.int32)
+    hashBpyArray(hash, mesh.polygons, 'use_smooth', np.bool_)
+    for layer in mesh.uv_layers:
+        hash.update(layer.name.encode('utf-8'))
+        hashBpyArray(hash, layer.data, 'uv', np.float32, 2)
+    if mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        hashBpyArray(hash, mesh.loops, 'normal', np.float32, 3)
+        mesh.free_normals_split()
+
+
+class MeshCache:
+    """On Disk Cache of Exported Mesh Arrays"""
+
+    def __init__(self, dirPath):
+        self.dirPath = dirPath
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(dirPath):
+            os.makedirs(dirPath)
+
+    def getKey(self, object, options):
+        # Key on the evaluated mesh, the modifier stack and export options
+        hash = hashlib.sha1()
+        hash.update(repr((CACHE_VERSION,) + tuple(options)).encode('utf-8'))
+        hash.update(repr(len(object.material_slots)).encode('utf-8'))
+        for modifier in object.modifiers:
+            hashBpyModifier(hash, modifier)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        evaluated = object.evaluated_get(depsgraph)
+        hashBpyMesh(hash, evaluated.to_mesh())
+        evaluated.to_mesh_clear()
+        return hash.hexdigest()
+
+    def getFilePath(self, key):
+        return os.path.join(self.dirPath, key + CACHE_EXTENSION)
+
+    def contains(self, key):
+        if os.path.isfile(self.getFilePath(key)):
+            return True
+        self.misses += 1
+        return False
+
+    def load(self, key):
+        filePath = self.getFilePath(key)
+        if not os.path.isfile(filePath):
+            self.misses += 1
+            return (None, None)
+        geometry = {}
+        subsets = {}
+        try:
+            data = np.load(filePath, allow_pickle = False)
+            for name in data.files:
+                if name.startswith(SUBSET_PREFIX):
+                    subsets[int(name[len(SUBSET_PREFIX):])] = data[name]
+                else:
+                    geometry[name] = data[name]
+            data.close()
+        except (OSError, ValueError, zipfile.BadZipFile):
+            print('Invalid mesh cache file:', filePath)
+            self.misses += 1
+            return (None, None)
+        self.hits += 1
+        return (geometry, subsets)
+
+    def save(self, key, geometry, subsets):
+        arrays = dict(geometry)
+        for material, indices in subsets.items():
+            arrays[SUBSET_PREFIX + str(material)] = indices
+        filePath = self.getFilePath(key)
+        # Replace the entry at once so other exports never read half of it
+        tempPath = filePath + '.%d.tmp' % os.getpid()
+        file = open(tempPath, 'wb')
+        np.savez(file, **{name: np.asarray(value) for name, value in arrays.items()})
+        file.close()
+        os.replace(tempPath, filePath)
@@ -2,6 +2,11 @@ import bpy
 import math
 import mathutils
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 epslon = 0.000001
 
 
@@ -140,7 +145,72 @@ def applyBpySmartProjection(mesh):
     bpy.ops.uv.smart_project()
 
 
-def exportBpyMeshVertexCounts(mesh, material = -1):
+def getBpyArray(collection, attribute, dtype, size = 1):
+    # Read one property of every item with a single foreach_get call
+    array = np.empty(len(collection) * size, dtype = dtype)
+    collection.foreach_get(attribute, array)
+    if size > 1:
+        return array.reshape((-1, size))
+    return array
+
+
+def remapIndices(indices, count):
+    # Number the used indices in the order they are first used
+    used, first = np.unique(indices, return_index = True)
+    order = used[np.argsort(first)]
+    remap = np.zeros(count, dtype = np.int32)
+    remap[order] = np.arange(len(order), dtype = np.int32)
+    return (remap[indices], order)
+
+
+def bucketIndices(keys):
+    # Indices of each key value, kept in their original order
+    order = np.argsort(keys, kind = 'stable').astype(np.int32)
+    values, starts = np.unique(keys[order], return_index = True)
+    return dict(zip(values.tolist(), np.split(order, starts[1:])))
+
+
+class MeshPartition:
+    """Mesh Polygons and Loops Grouped by Material"""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.counts = getBpyArray(mesh.polygons, 'loop_total', np.int32)
+        materials = getBpyArray(mesh.polygons, 'material_index', np.int32)
+        self.loopVertices = getBpyArray(mesh.loops, 'vertex_index', np.int32)
+        # Polygon loops are stored one polygon after another
+        self.faces = bucketIndices(materials)
+        self.loops = bucketIndices(np.repeat(materials, self.counts))
+        self.remaps = {}
+
+    def getFaces(self, material):
+        return self.faces.get(material, np.zeros(0, dtype = np.int32))
+
+    def getCounts(self, material):
+        return self.counts[self.getFaces(material)]
+
+    def getLoops(self, material):
+        return self.loops.get(material, np.zeros(0, dtype = np.int32))
+
+    def getVertexRemap(self, material):
+        # Loop vertices renumbered over the vertices the material uses
+        if not material in self.remaps:
+            indices = self.loopVertices[self.getLoops(material)]
+            self.remaps[material] = remapIndices(indices, len(self.mesh.vertices))
+        return self.remaps[material]
+
+
+def getMeshPartition(mesh, partition = None):
+    if partition != None:
+        return partition
+    return MeshPartition(mesh)
+
+
+def exportBpyMeshVertexCounts(mesh, material = -1, partition = None):
+    if np != None:
+        if material == -1:
+            return getBpyArray(mesh.polygons, 'loop_total', np.int32)
+        return getMeshPartition(mesh, partition).getCounts(material)
     counts = []
     if material == -1:
         counts = [len(poly.vertices) for poly in mesh.polygons]
@@ -151,7 +221,11 @@ def exportBpyMeshVertexCounts(mesh, material = -1):
     return counts
 
 
-def exportBpyFaceIndices(mesh, material = -1):
+def exportBpyFaceIndices(mesh, material = -1, partition = None):
+    if np != None:
+        if material == -1:
+            return np.arange(len(mesh.polygons), dtype = np.int32)
+        return getMeshPartition(mesh, partition).getFaces(material)
     indices = []
     for poly in mesh.polygons:
         if poly.material_index == material or material == -1:
@@ -159,7 +233,13 @@ def exportBpyFaceIndices(mesh, material = -1):
     return indices
 
 
-def exportBpyMeshVertices(mesh, material = -1):
+def exportBpyMeshVertices(mesh, material = -1, partition = None):
+    if np != None:
+        vertices = getBpyArray(mesh.vertices, 'co', np.float32, 3)
+        if material == -1:
+            return (getBpyArray(mesh.loops, 'vertex_index', np.int32), vertices)
+        indices, order = getMeshPartition(mesh, partition).getVertexRemap(material)
+        return (indices, vertices[order])
     indices = []
     vertices = []
     if material == -1:
@@ -188,7 +268,37 @@ def addValueIndex(valueMap, values, indices, value, repeats = 1):
         valueMap[value] = index
 
 
-def exportBpyMeshNormals(mesh, material = -1):
+def getRowKeys(rows):
+    # View each row as one scalar so np.unique compares whole rows
+    rows = np.ascontiguousarray(rows)
+    size = rows.dtype.itemsize * rows.shape[1]
+    if size in (4, 8):
+        return rows.view('<u%d' % size)[:, 0]
+    return rows.view(np.dtype((np.void, size)))[:, 0]
+
+
+def indexValues(values, tolerance = 0.0):
+    # Deduplicate rows in one pass, numbering them in order of first use
+    if len(values) == 0:
+        return (np.zeros(0, dtype = np.int32), values)
+    if tolerance > 0.0:
+        # Values within the same tolerance cell are welded together
+        keys = np.round(values / tolerance)
+        keys = keys.astype(np.int32 if np.abs(keys).max() < (1 << 31) else np.int64)
+    else:
+        # Adding zero turns -0.0 into 0.0 so both match like tuples do
+        keys = values + values.dtype.type(0)
+    keys = getRowKeys(keys)
+    unique, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype = np.int32)
+    rank[order] = np.arange(len(order), dtype = np.int32)
+    return (rank[inverse.reshape(-1)], values[first[order]])
+
+
+def exportBpyMeshNormals(mesh, material = -1, tolerance = 0.0, partition = None):
+    if np != None:
+        return exportBpyMeshNormalsArray(mesh, material, tolerance, partition)
     indices = []
     normals = []
     normalMap = {}
@@ -212,7 +322,33 @@ def exportBpyMeshNormals(mesh, material = -1):
     return (indices, normals)
 
 
-def exportBpyMeshUvs(mesh, layer, material = -1):
+def exportBpyMeshNormalsArray(mesh, material = -1, tolerance = 0.0, partition = None):
+    if mesh.has_custom_normals:
+        # Calculate and Export Custom Normals
+        mesh.calc_normals_split()
+        normals = getBpyArray(mesh.loops, 'normal', np.float32, 3)
+        mesh.free_normals_split()
+        return indexValues(normals, tolerance)
+    # Smooth faces use vertex normals and flat faces the face normal
+    counts = getBpyArray(mesh.polygons, 'loop_total', np.int32)
+    smooth = getBpyArray(mesh.polygons, 'use_smooth', np.bool_)
+    loopVertices = getBpyArray(mesh.loops, 'vertex_index', np.int32)
+    vertexNormals = getBpyArray(mesh.vertices, 'normal', np.float32, 3)
+    polyNormals = getBpyArray(mesh.polygons, 'normal', np.float32, 3)
+    normals = np.repeat(polyNormals, counts, axis = 0)
+    smoothLoops = np.repeat(smooth, counts)
+    normals[smoothLoops] = vertexNormals[loopVertices[smoothLoops]]
+    if material != -1:
+        normals = normals[getMeshPartition(mesh, partition).getLoops(material)]
+    return indexValues(normals, tolerance)
+
+
+def exportBpyMeshUvs(mesh, layer, material = -1, tolerance = 0.0, partition = None):
+    if np != None:
+        uvs = getBpyArray(layer.data, 'uv', np.float32, 2)
+        if material != -1:
+            uvs = uvs[getMeshPartition(mesh, partition).getLoops(material)]
+        return indexValues(uvs, tolerance)
     indices = []
     uvs = []
     uvMap = {}
@@ -226,23 +362,23 @@ def exportBpyMeshUvs(mesh, layer, material = -1):
     return (indices, uvs)
 
 
-def exportBpyVertexWeights(index, groups):
-    indices = []
-    weights = []
-    for group in groups:
-        try:
-            weight = group.weight(index)
-            if weight > epslon:
-                indices.append(group.index)
-                weights.append(weight)
-        except RuntimeError:
-            pass
-    return (indices, weights)
-
-
-def exportBpyMeshIndices(obj, material = -1):
+def exportBpyVertexGroups(vertex, maxInfluences = 0):
+    # Read the groups the vertex belongs to instead of probing every group
+    items = [(e.group, e.weight) for e in vertex.groups if e.weight > epslon]
+    if maxInfluences > 0 and len(items) > maxInfluences:
+        # Keep the strongest influences and renormalize their weights
+        items = sorted(items, key = lambda item: item[1], reverse = True)[:maxInfluences]
+        total = sum(w for g, w in items)
+        items = [(g, w / total) for g, w in items]
+    items.sort()
+    return ([g for g, w in items], [w for g, w in items])
+
+
+def exportBpyMeshIndices(obj, material = -1, partition = None):
     if material == -1:
         return [i for i in range(0, len(obj.data.vertices))]
+    if np != None:
+        return getMeshPartition(obj.data, partition).getVertexRemap(material)[1].tolist()
     indices = []
     indexSet = set()
     for poly in obj.data.polygons:
@@ -254,22 +390,37 @@ def exportBpyMeshIndices(obj, material = -1):
     return indices
 
 
-def exportBpyMeshWeights(obj, material = -1):
+def exportBpyMeshWeights(obj, material = -1, partition = None, maxInfluences = 0):
     groups = []
     weights = []
     size = 0
-    indices = exportBpyMeshIndices(obj, material)
-    items = []
-    for index in indices:
-        item = exportBpyVertexWeights(index, obj.vertex_groups)
-        size = max(size, len(item[0]))
-        items.append(item)
+    vertices = obj.data.vertices
+    if material != -1:
+        vertices = [vertices[i] for i in exportBpyMeshIndices(obj, material, partition)]
+    items = [exportBpyVertexGroups(v, maxInfluences) for v in vertices]
+    if np != None:
+        return padBpyWeights(items)
+    for g, w in items:
+        size = max(size, len(g))
     for g, w in items:
         groups += g + (size-len(g))*[0]
         weights += w + (size-len(w))*[0.0]
     return (groups, weights, size)
 
 
+def padBpyWeights(items):
+    # Scatter every influence into padded rows with one assignment
+    counts = np.array([len(g) for g, w in items], dtype = np.int32)
+    size = int(counts.max()) if len(counts) > 0 else 0
+    groups = np.zeros((len(items), size), dtype = np.int32)
+    weights = np.zeros((len(items), size), dtype = np.float32)
+    rows = np.repeat(np.arange(len(items)), counts)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    groups[rows, cols] = [g for item in items for g in item[0]]
+    weights[rows, cols] = [w for item in items for w in item[1]]
+    return (groups.reshape(-1), weights.reshape(-1), size)
+
+
 def createBpyCollection(name):
     collection = bpy.data.collections.new(name)
     bpy.context.scene.collection.children.link(collection)
@@ -286,9 +286,15 @@ class Mesh:
         self.scene = scene
         self.objectCopy = None
         self.armatueCopy = None
+        self.partition = None
         self.shared = False
         self.usdMesh = None
-        self.createCopies()
+        self.cacheKey = ''
+        self.cached = False
+        self.subsets = None
+        self.findCache()
+        if not self.cached:
+            self.createCopies()
 
 
     def __del__(self):
@@ -325,6 +331,7 @@ class Mesh:
 
 
     def clearCopies(self):
+        self.partition = None
         if self.objectCopy != None:
             deleteBpyObject(self.objectCopy)
             self.objectCopy = None
@@ -333,6 +340,43 @@ class Mesh:
             self.armatueCopy = None
 
 
+    def getPartition(self):
+        # Group the polygons by material once for every subset
+        if self.partition == None and np != None:
+            self.partition = MeshPartition(self.objectCopy.data)
+        return self.partition
+
+
+    def findCache(self):
+        # Baked and skinned meshes still need their object copies
+        cache = self.scene.meshCache
+        if cache == None or self.scene.bakeTextures or self.scene.bakeAO:
+            return
+        if self.getArmature() != None and self.scene.animated:
+            return
+        self.cacheKey = cache.getKey(self.object, (self.scene.scale,))
+        self.cached = cache.contains(self.cacheKey)
+
+
+    def loadCache(self):
+        # Entries are loaded when exported so only one mesh is in memory
+        geometry, self.subsets = self.scene.meshCache.load(self.cacheKey)
+        if geometry == None and self.objectCopy == None:
+            # Unreadable entries are exported from the object again
+            self.createCopies()
+        return geometry
+
+
+    def saveCache(self, geometry):
+        subsets = {}
+        if len(self.object.material_slots) > 1:
+            partition = self.getPartition()
+            for i in range(len(self.object.material_slots)):
+                subsets[i] = exportBpyFaceIndices(self.objectCopy.data, i, partition)
+        self.scene.meshCache.save(self.cacheKey, geometry, subsets)
+        self.subsets = subsets
+
+
     def getArmature(self):
         parent = self.object.parent
         if parent != None and parent.type == 'ARMATURE':
@@ -340,21 +384,11 @@ class Mesh:
         return None
 
 
-    def exportMeshUvs(self, usdMesh):
-        mesh = self.objectCopy.data
-        for layer in mesh.uv_layers:
-            indices, uvs = exportBpyMeshUvs(mesh, layer)
-            name = layer.name.replace('.', '_')
-            usdMesh['primvars:'+name] = uvs
-            usdMesh['primvars:'+name].valueTypeStr = 'texCoord2f'
-            usdMesh['primvars:'+name]['interpolation'] = 'faceVarying'
-            usdMesh['primvars:'+name+':indices'] = indices
-
-
     def exportJoints(self, usdMesh):
         mesh = self.objectCopy.data
         if self.armatueCopy != None and self.scene.animated:
-            indices, weights, size = exportBpyMeshWeights(self.objectCopy)
+            maxInfluences = self.scene.maxInfluences
+            indices, weights, size = exportBpyMeshWeights(self.objectCopy, maxInfluences = maxInfluences)
             usdMesh['primvars:skel:jointIndices'] = indices
             usdMesh['primvars:skel:jointIndices']['elementSize'] = size
             usdMesh['primvars:skel:jointIndices']['interpolation'] = 'vertex'
@@ -386,22 +420,59 @@ class Mesh:
         return self.usdMesh
 
 
-    def exportToObject(self, usdObj, classType = ClassType.Mesh):
+    def exportGeometry(self):
+        # Mesh attribute arrays in the order they are exported
         mesh = self.objectCopy.data
-        name = self.object.data.name.replace('.', '_')
-        usdMesh = usdObj.createChild(name, classType)
-        usdMesh['extent'] = exportBpyExtents(self.objectCopy, self.scene.scale)
-        usdMesh['faceVertexCounts'] = exportBpyMeshVertexCounts(mesh)
+        geometry = {}
+        geometry['extent'] = exportBpyExtents(self.objectCopy, self.scene.scale)
+        geometry['faceVertexCounts'] = exportBpyMeshVertexCounts(mesh)
         indices, points = exportBpyMeshVertices(mesh)
-        usdMesh['faceVertexIndices'] = indices
-        usdMesh['points'] = points
-        usdMesh['points'].valueTypeStr = 'point3f'
-        self.exportMeshUvs(usdMesh)
+        geometry['faceVertexIndices'] = indices
+        geometry['points'] = points
+        for layer in mesh.uv_layers:
+            indices, uvs = exportBpyMeshUvs(mesh, layer)
+            name = 'primvars:' + layer.name.replace('.', '_')
+            geometry[name] = uvs
+            geometry[name+':indices'] = indices
         indices, normals = exportBpyMeshNormals(mesh)
-        usdMesh['primvars:normals'] = normals
-        usdMesh['primvars:normals'].valueTypeStr = 'normal3f'
-        usdMesh['primvars:normals']['interpolation'] = 'faceVarying'
-        usdMesh['primvars:normals:indices'] = indices
+        geometry['primvars:normals'] = normals
+        geometry['primvars:normals:indices'] = indices
+        return geometry
+
+
+    def getGeometry(self):
+        # The arrays belong to the exported prim, the mesh doesn't keep them
+        geometry = None
+        if self.cached:
+            geometry = self.loadCache()
+        if geometry == None:
+            geometry = self.exportGeometry()
+            if self.cacheKey != '':
+                self.saveCache(geometry)
+        return geometry
+
+
+    def exportFaceIndices(self, material):
+        if self.subsets != None and material in self.subsets:
+            # Each subset is exported once, so its indices are released
+            return self.subsets.pop(material)
+        mesh = self.objectCopy.data
+        return exportBpyFaceIndices(mesh, material, self.getPartition())
+
+
+    def exportToObject(self, usdObj, classType = ClassType.Mesh):
+        name = self.object.data.name.replace('.', '_')
+        usdMesh = usdObj.createChild(name, classType)
+        for name, value in self.getGeometry().items():
+            usdMesh[name] = value
+            if name == 'points':
+                usdMesh[name].valueTypeStr = 'point3f'
+            elif name == 'primvars:normals':
+                usdMesh[name].valueTypeStr = 'normal3f'
+                usdMesh[name]['interpolation'] = 'faceVarying'
+            elif name.startswith('primvars:') and not name.endswith(':indices'):
+                usdMesh[name].valueTypeStr = 'texCoord2f'
+                usdMesh[name]['interpolation'] = 'faceVarying'
         usdMesh['subdivisionScheme'] = 'none'
         usdMesh['subdivisionScheme'].addQualifier('uniform')
         return usdMesh
@@ -440,7 +511,7 @@ class Object:
     def cleanup(self):
         if self.mesh != None:
             self.mesh.cleanup()
-            self.mesn = None
+            self.mesh = None
         self.materials = []
         self.object.hide_render = self.hidden
 
@@ -632,13 +703,12 @@ class Object:
             usdMesh['material:binding'] = self.materials[0].usdMaterial
         elif len(self.materials) > 1:
             for i, mat in enumerate(self.materials):
-                mesh = self.mesh.objectCopy.data
                 subset = usdMesh.createChild(mat.name, ClassType.GeomSubset)
                 subset['elementType'] = 'face'
                 subset['elementType'].addQualifier('uniform')
                 subset['familyName'] = 'materialBind'
                 subset['familyName'].addQualifier('uniform')
-                subset['indices'] = exportBpyFaceIndices(mesh, i)
+                subset['indices'] = self.mesh.exportFaceIndices(i)
                 subset['material:binding'] = mat.usdMaterial
                 #subset['material:binding'].addQualifier('uniform')
 
@@ -798,6 +868,8 @@ class Scene:
         self.sharedMeshes = True
         self.scale = 1.0
         self.animated = False
+        self.maxInfluences = 0
+        self.meshCache = None
         self.startFrame = 0
         self.endFrame = 0
         self.curFrame = 0
@@ -979,7 +1051,7 @@ class Scene:
                 self.usdCollections[name] = collection
 
 
-    def exportUsd(self):
+    def exportUsd(self, crate = None):
         data = UsdData()
         data['upAxis'] = 'Y'
         if self.animated:
@@ -987,6 +1059,9 @@ class Scene:
             data['endTimeCode'] = float(self.endFrame)
             data['timeCodesPerSecond'] = float(self.fps)
         data['customLayerData'] = self.customLayerData
+        if crate != None:
+            # Stream each root prim to the crate file once it is complete
+            crate.beginUsd(data)
         if self.exportMaterials:
             self.exportSharedMaterials(data)
         if self.sharedMeshes:
@@ -994,4 +1069,8 @@ class Scene:
         self.exportCollections(data)
         for obj in self.objects:
             obj.exportUsd(data)
+            if crate != None:
+                crate.writeUsdChildren(data)
+        if crate != None:
+            crate.endUsd(data)
         return data
@@ -0,0 +1,483 @@
+import re
+import mmap
+from io_scene_usdz.value_types import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOKEN_PATTERN = re.compile(rb'''
+    (?P<space>(?:\s+|\#[^\n]*)+)
+    |(?P<string>"""(?:.|\n)*?"""|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<asset>@[^@]*@)
+    |(?P<path><[^>]*>)
+    |(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?inf\b|nan\b)
+    |(?P<name>[A-Za-z_][\w:.]*(?:\[\])?)
+    |(?P<punct>[=(){}\[\],:;])
+''', re.X)
+
+# Tuple punctuation is replaced by spaces before bulk parsing
+ARRAY_TRANSLATION = bytes.maketrans(b'(),', b'   ')
+
+SPECIFIERS = {
+    'def': SpecifierType.Def,
+    'over': SpecifierType.Over,
+    'class': SpecifierType.Class,
+}
+
+PROPERTY_QUALIFIERS = ('custom', 'uniform', 'varying', 'config', 'prepend',
+                       'append', 'add', 'delete', 'reorder')
+
+LIST_OPS = ('prepend', 'append', 'add', 'delete', 'reorder')
+
+COMPONENT_DTYPES = {'i': 'i4', 'h': 'f4', 'f': 'f4', 'd': 'f8'}
+
+DOUBLE_METADATA = ('startTimeCode', 'endTimeCode', 'timeCodesPerSecond',
+                   'framesPerSecond', 'metersPerUnit')
+
+
+def getValueTypeComponents(valueType):
+    # Number of scalars in each element and the element shape
+    name = valueType.name
+    if name[:3] == 'vec':
+        size = int(name[3])
+        return size, (size,)
+    if name[:4] == 'quat':
+        return 4, (4,)
+    if name[:6] == 'matrix':
+        size = int(name[6])
+        return size * size, (size, size)
+    return 1, ()
+
+
+def getValueTypeDtype(valueType):
+    # Match the array types returned by CrateFile.readUsd
+    name = valueType.name
+    if name in ('int', 'uint', 'uchar'):
+        return 'i4'
+    if name in ('int64', 'uint64'):
+        return 'i8'
+    if name in ('float', 'half'):
+        return 'f4'
+    if name == 'double':
+        return 'f8'
+    if name[:3] == 'vec' or name[:4] == 'quat' or name[:6] == 'matrix':
+        return COMPONENT_DTYPES.get(name[-1])
+    # Invalid and non-numeric types are parsed token by token
+    return None
+
+
+def toFloats(value):
+    if type(value) is int:
+        return float(value)
+    if type(value) is tuple:
+        return tuple(toFloats(v) for v in value)
+    if type(value) is list:
+        return [toFloats(v) for v in value]
+    return value
+
+
+def groupValues(values, shape):
+    # Nest a flat list of scalars into tuples of the element shape
+    for size in reversed(shape):
+        values = [tuple(values[i:i + size]) for i in range(0, len(values), size)]
+    return values
+
+
+def decodeString(text):
+    if text[:3] in (b'"""', b"'''"):
+        text = text[3:-3]
+    else:
+        text = text[1:-1]
+    text = text.decode('utf-8')
+    if '\\' in text:
+        text = text.replace('\\"', '"').replace("\\'", "'").replace('\\n', '\n')
+        text = text.replace('\\\\', '\\')
+    return text
+
+
+def joinPath(primPath, path):
+    # Resolve a path relative to the prim it was authored on
+    if path[:1] == '/':
+        return path
+    parts = primPath.split('/')
+    for part in path.split('/'):
+        if part == '..':
+            parts.pop()
+        elif part == '.':
+            continue
+        elif part[:1] == '.':
+            parts[-1] += part
+        else:
+            parts.append(part)
+    return '/'.join(parts)
+
+
+class UsdaPath:
+    """Unresolved Path from a usda File"""
+
+    def __init__(self, path):
+        self.path = path
+
+
+class UsdaReference:
+    """Asset Reference with an Optional Prim Path"""
+
+    def __init__(self, asset, path = ''):
+        self.asset = asset
+        self.path = path
+
+
+class UsdaFile:
+    """Reader for usda Text Files"""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = b''
+        self.mapping = None
+        self.pos = 0
+        self.token = (None, b'')
+        self.arrays = False
+        self.items = {}
+        self.links = []
+
+    def mapFile(self):
+        try:
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = self.mapping
+        except (AttributeError, OSError, ValueError):
+            # Streams without a file descriptor are read into memory
+            self.buffer = self.file.read()
+
+    def close(self):
+        self.buffer = b''
+        if self.mapping != None:
+            self.mapping.close()
+            self.mapping = None
+
+    def scan(self):
+        # Read the next token after any whitespace and comments
+        while True:
+            match = TOKEN_PATTERN.match(self.buffer, self.pos)
+            if match == None:
+                if self.pos >= len(self.buffer):
+                    return (None, b'')
+                raise ValueError('Unexpected character at offset %d' % self.pos)
+            self.pos = match.end()
+            if match.lastgroup != 'space':
+                return (match.lastgroup, match.group())
+
+    def peek(self):
+        return self.token
+
+    def next(self):
+        token = self.token
+        self.token = self.scan()
+        return token
+
+    def nextText(self):
+        return self.next()[1].decode('utf-8')
+
+    def isNext(self, text):
+        return self.token[1] == text
+
+    def expect(self, text):
+        kind, found = self.next()
+        if found != text:
+            raise ValueError('Expected %s but found %s' % (text, found))
+
+    def skipSeparators(self):
+        while self.token[1] in (b',', b';'):
+            self.next()
+
+    def readUsd(self, arrays = False):
+        self.arrays = arrays and np != None
+        self.items = {}
+        self.links = []
+        data = UsdData()
+        self.mapFile()
+        try:
+            if self.buffer[:5] != b'#usda':
+                raise ValueError('Missing #usda header')
+            self.pos = 0
+            self.token = self.scan()
+            if self.isNext(b'('):
+                data.metadata = self.parseMetadata()
+                for name in DOUBLE_METADATA:
+                    if name in data.metadata:
+                        data.metadata[name] = toFloats(data.metadata[name])
+            while self.token[0] != None:
+                self.parsePrim(data, '')
+        finally:
+            # Parse errors reach the caller instead of a partial scene
+            self.close()
+        self.resolveLinks()
+        data.updatePathIndices()
+        return data
+
+    def resolveLinks(self):
+        for item, key, path in self.links:
+            target = self.items.get(path)
+            if target == None:
+                print('Unresolved Path:', path)
+            if key == None:
+                item.value = target
+            else:
+                item.metadata[key] = target
+
+    def addLink(self, item, key, path, primPath):
+        self.links.append((item, key, joinPath(primPath, path)))
+
+    def parsePrim(self, parent, parentPath):
+        specifier = self.nextText()
+        if not specifier in SPECIFIERS:
+            raise ValueError('Unexpected %s' % specifier)
+        classType = None
+        if self.peek()[0] == 'name':
+            typeName = self.nextText()
+            classType = ClassType[typeName] if typeName in ClassType.__members__ else None
+        kind, name = self.next()
+        if kind != 'string':
+            raise ValueError('Expected prim name but found %s' % name)
+        prim = parent.createChild(decodeString(name), classType)
+        prim.specifierType = SPECIFIERS[specifier]
+        path = parentPath + '/' + prim.name
+        self.items[path] = prim
+        if self.isNext(b'('):
+            metadata = self.parseMetadata()
+            for key in ('inherits', 'references', 'specializes'):
+                value = metadata.get(key)
+                if type(value) is list and len(value) > 0:
+                    value = value[0]
+                if type(value) is UsdaReference and value.asset == '':
+                    value = UsdaPath(value.path)
+                if type(value) is UsdaPath:
+                    self.addLink(prim, key, value.path, path)
+            prim.metadata = metadata
+        self.expect(b'{')
+        while not self.isNext(b'}'):
+            if self.token[0] == None:
+                raise ValueError('Unexpected end of file in %s' % path)
+            text = self.token[1].decode('utf-8')
+            if text in SPECIFIERS:
+                self.parsePrim(prim, path)
+            elif text == 'variantSet':
+                self.skipStatement()
+            else:
+                self.parseProperty(prim, path)
+            self.skipSeparators()
+        self.next()
+
+    def skipStatement(self):
+        # Skip unsupported statements including nested blocks
+        depth = 0
+        while self.token[0] != None:
+            kind, text = self.next()
+            if text in (b'{', b'(', b'['):
+                depth += 1
+            elif text in (b'}', b')', b']'):
+                depth -= 1
+                if depth == 0 and text == b'}':
+                    return
+
+    def parseProperty(self, prim, primPath):
+        qualifiers = []
+        while self.token[1].decode('utf-8') in PROPERTY_QUALIFIERS:
+            qualifiers.append(self.nextText())
+        typeStr = self.nextText()
+        name = self.nextText()
+        suffix = ''
+        for s in ('.connect', '.timeSamples'):
+            if name.endswith(s):
+                name = name[:-len(s)]
+                suffix = s
+        if typeStr == 'rel':
+            att = prim[name]
+            if att == None:
+                att = prim.createAttribute(name)
+            att.valueTypeStr = 'rel'
+            self.addQualifiers(att, qualifiers)
+            if self.isNext(b'='):
+                self.next()
+                value = self.parseValue()
+                if type(value) is list and len(value) > 0:
+                    value = value[0]
+                if type(value) is UsdaPath:
+                    self.addLink(att, None, value.path, primPath)
+            self.parsePropertyMetadata(att)
+            self.items[primPath + '.' + name] = att
+            return
+        isArray = typeStr[-2:] == '[]'
+        typeStr = typeStr.replace('[]', '')
+        try:
+            valueType = getValueTypeFromStr(typeStr)
+        except KeyError:
+            valueType = ValueType.Invalid
+        att = prim[name]
+        if att == None:
+            att = prim.createAttribute(name, None, valueType)
+            if att.valueType.name != typeStr:
+                att.valueTypeStr = typeStr
+            self.addQualifiers(att, qualifiers)
+        self.items[primPath + '.' + name] = att
+        if suffix == '.connect':
+            self.expect(b'=')
+            value = self.parseValue()
+            if type(value) is list and len(value) > 0:
+                value = value[0]
+            if type(value) is UsdaPath:
+                self.addLink(att, None, value.path, primPath)
+        elif suffix == '.timeSamples':
+            self.expect(b'=')
+            att.frames = self.parseTimeSamples(valueType, isArray)
+        elif self.isNext(b'='):
+            self.next()
+            value = self.parseTypedValue(valueType, isArray, self.arrays)
+            if valueType == ValueType.asset and type(value) is str:
+                value = value.replace('@', '')
+            att.value = value
+        self.parsePropertyMetadata(att)
+
+    def addQualifiers(self, att, qualifiers):
+        # Qualifiers are kept in the order they were written
+        for q in qualifiers:
+            att.addQualifier(q)
+
+    def parsePropertyMetadata(self, att):
+        if self.isNext(b'('):
+            for key, value in self.parseMetadata().items():
+                att[key] = value
+
+    def parseTimeSamples(self, valueType, isArray):
+        frames = []
+        self.expect(b'{')
+        while not self.isNext(b'}'):
+            frame = self.parseValue()
+            self.expect(b':')
+            value = self.parseTypedValue(valueType, isArray, False)
+            frames.append((float(frame), value))
+            self.skipSeparators()
+        self.next()
+        return frames
+
+    def parseTypedValue(self, valueType, isArray, arrays):
+        if isArray and self.isNext(b'[') and getValueTypeDtype(valueType) != None:
+            return self.parseNumericArray(valueType, arrays)
+        value = self.parseValue()
+        if getValueTypeDtype(valueType) in ('f4', 'f8'):
+            value = toFloats(value)
+        elif valueType == ValueType.bool:
+            value = [bool(v) for v in value] if type(value) is list else bool(value)
+        return value
+
+    def parseNumericArray(self, valueType, arrays):
+        # Parse the whole array in one call instead of token by token
+        start = self.pos
+        end = self.buffer.find(b']', start)
+        if end < 0:
+            raise ValueError('Unterminated array at offset %d' % start)
+        text = self.buffer[start:end].translate(ARRAY_TRANSLATION)
+        self.pos = end + 1
+        self.token = self.scan()
+        size, shape = getValueTypeComponents(valueType)
+        dtype = getValueTypeDtype(valueType)
+        if np != None:
+            # Values are parsed at full precision like the scalar tokens
+            parseType = 'i8' if dtype[0] == 'i' else 'f8'
+            if len(text.strip()) == 0:
+                values = np.zeros(0, dtype = parseType)
+            else:
+                values = np.fromstring(text, dtype = parseType, sep = ' ')
+            if len(values) % size != 0:
+                raise ValueError('Array size does not match %s' % valueType.name)
+            values = values.reshape((-1,) + shape)
+            if arrays:
+                return values.astype('<' + dtype)
+            return arrayToList(values)
+        values = [float(v) for v in text.split()]
+        if dtype[0] == 'i':
+            values = [int(v) for v in values]
+        return groupValues(values, shape)
+
+    def parseValue(self):
+        kind, text = self.next()
+        if kind == 'number':
+            if text.isdigit() or (text[:1] in b'-+' and text[1:].isdigit()):
+                return int(text)
+            return float(text)
+        if kind == 'string':
+            return decodeString(text)
+        if kind == 'asset':
+            asset = text.decode('utf-8')
+            if self.peek()[0] == 'path':
+                # References pair the asset with a prim path
+                path = self.next()[1][1:-1].decode('utf-8')
+                return UsdaReference(asset[1:-1], path)
+            return asset
+        if kind == 'path':
+            return UsdaPath(text[1:-1].decode('utf-8'))
+        if kind == 'name':
+            text = text.decode('utf-8')
+            if text == 'true':
+                return True
+            if text == 'false':
+                return False
+            if text == 'None':
+                return None
+            return text
+        if text == b'(':
+            return tuple(self.parseItems(b')'))
+        if text == b'[':
+            return self.parseItems(b']')
+        if text == b'{':
+            return self.parseDictionary()
+        raise ValueError('Unexpected %s' % text)
+
+    def parseItems(self, end):
+        items = []
+        while not self.isNext(end):
+            items.append(self.parseValue())
+            self.skipSeparators()
+        self.next()
+        return items
+
+    def parseDictionary(self):
+        dic = {}
+        while not self.isNext(b'}'):
+            typeStr = self.nextText()
+            key = self.parseKey()
+            self.expect(b'=')
+            value = self.parseValue()
+            if typeStr == 'bool':
+                value = bool(value)
+            elif typeStr in ('float', 'double', 'half') or typeStr[-1:] in ('f', 'd', 'h'):
+                value = toFloats(value)
+            dic[key] = value
+            self.skipSeparators()
+        self.next()
+        return dic
+
+    def parseKey(self):
+        kind, text = self.next()
+        if kind == 'string':
+            return decodeString(text)
+        return text.decode('utf-8')
+
+    def parseMetadata(self):
+        metadata = {}
+        self.expect(b'(')
+        while not self.isNext(b')'):
+            if self.token[0] == 'string':
+                # Documentation strings without a key
+                metadata['doc'] = decodeString(self.next()[1])
+                self.skipSeparators()
+                continue
+            key = self.parseKey()
+            if key in LIST_OPS and self.peek()[0] == 'name':
+                key = self.parseKey()
+            self.expect(b'=')
+            metadata[key] = self.parseValue()
+            self.skipSeparators()
+        self.next()
+        return metadata
@@ -0,0 +1,200 @@
+import os
+import mmap
+import zlib
+import struct
+
+CENTRAL_DIR_SIGNATURE = b'\x50\x4b\x01\x02'
+END_CENTRAL_DIR_SIGNATURE = b'\x50\x4b\x05\x06'
+ZIP64_END_CENTRAL_DIR_SIGNATURE = b'\x50\x4b\x06\x06'
+ZIP64_LOCATOR_SIGNATURE = b'\x50\x4b\x06\x07'
+END_CENTRAL_DIR_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+MAX_COMMENT_SIZE = 0xffff
+ZIP64_LIMIT = 0xffffffff
+ZIP64_ENTRY_LIMIT = 0xffff
+
+
+def readZip64Extra(extra, size, compSize, offset):
+    # Fields at the 32 bit limit are read from the ZIP64 extra field
+    pos = 0
+    while pos + 4 <= len(extra):
+        headerId, length = struct.unpack_from('<HH', extra, pos)
+        pos += 4
+        if headerId == 1:
+            values = []
+            for i in range(length // 8):
+                values += struct.unpack_from('<Q', extra, pos + i * 8)
+            if size == ZIP64_LIMIT and len(values) > 0:
+                size = values.pop(0)
+            if compSize == ZIP64_LIMIT and len(values) > 0:
+                compSize = values.pop(0)
+            if offset == ZIP64_LIMIT and len(values) > 0:
+                offset = values.pop(0)
+        pos += length
+    return (size, compSize, offset)
+
+
+class BufferFile:
+    """Seekable File View of a Memory Buffer"""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def read(self, size = -1):
+        end = len(self.view) if size < 0 else min(self.offset + size, len(self.view))
+        data = self.view[self.offset:end].tobytes()
+        self.offset = end
+        return data
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += len(self.view)
+        self.offset = max(0, offset)
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def getbuffer(self):
+        return self.view
+
+    def close(self):
+        try:
+            self.view.release()
+        except BufferError:
+            # NumPy arrays still view the buffer and keep it open
+            pass
+
+
+class UsdzEntry:
+    """Stored File in a usdz Archive"""
+
+    def __init__(self, name, offset, size, compressedSize, method, crc):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.compressedSize = compressedSize
+        self.method = method
+        self.crc = crc
+        self.dataOffset = -1
+
+
+class UsdzReader:
+    """Reader for usdz Archives Without Extraction"""
+
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.mapping = None
+        self.buffer = b''
+        self.entries = []
+        self.entryMap = {}
+        file = open(filePath, 'rb')
+        try:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = self.mapping
+        except (OSError, ValueError):
+            # Empty or unmappable files are read into memory
+            self.buffer = file.read()
+        file.close()
+        self.readCentralDir()
+
+    def findEndCentralDir(self):
+        start = max(0, len(self.buffer) - END_CENTRAL_DIR_SIZE - MAX_COMMENT_SIZE)
+        return self.buffer.rfind(END_CENTRAL_DIR_SIGNATURE, start)
+
+    def readCentralDir(self):
+        end = self.findEndCentralDir()
+        if end < 0:
+            print('Invalid usdz file:', self.filePath)
+            return
+        numEntries, cdLength, cdOffset = struct.unpack_from('<2xHII', self.buffer, end + 8)
+        if numEntries == ZIP64_ENTRY_LIMIT or cdLength == ZIP64_LIMIT or cdOffset == ZIP64_LIMIT:
+            numEntries, cdLength, cdOffset = self.readZip64EndCentralDir(end)
+        offset = cdOffset
+        for i in range(numEntries):
+            if self.buffer[offset:offset + 4] != CENTRAL_DIR_SIGNATURE:
+                print('Invalid usdz central directory:', self.filePath)
+                return
+            method, crc, compSize, size, nameLen, extraLen, commentLen = struct.unpack_from('<6xH4xIIIHHH', self.buffer, offset + 4)
+            localOffset, = struct.unpack_from('<I', self.buffer, offset + 42)
+            name = bytes(self.buffer[offset + 46:offset + 46 + nameLen]).decode('utf-8')
+            extraOffset = offset + 46 + nameLen
+            extra = self.buffer[extraOffset:extraOffset + extraLen]
+            size, compSize, localOffset = readZip64Extra(extra, size, compSize, localOffset)
+            entry = UsdzEntry(name, localOffset, size, compSize, method, crc)
+            self.entries.append(entry)
+            self.entryMap[name] = entry
+            offset += 46 + nameLen + extraLen + commentLen
+
+    def readZip64EndCentralDir(self, end):
+        locator = end - ZIP64_LOCATOR_SIZE
+        if locator < 0 or self.buffer[locator:locator + 4] != ZIP64_LOCATOR_SIGNATURE:
+            print('Missing ZIP64 locator:', self.filePath)
+            return (0, 0, 0)
+        recordOffset, = struct.unpack_from('<Q', self.buffer, locator + 8)
+        if self.buffer[recordOffset:recordOffset + 4] != ZIP64_END_CENTRAL_DIR_SIGNATURE:
+            print('Invalid ZIP64 end of central directory:', self.filePath)
+            return (0, 0, 0)
+        return struct.unpack_from('<8xQQQ', self.buffer, recordOffset + 24)
+
+    def getDataOffset(self, entry):
+        # Data starts after the local header and its alignment padding
+        if entry.dataOffset < 0:
+            nameLen, extraLen = struct.unpack_from('<HH', self.buffer, entry.offset + 26)
+            entry.dataOffset = entry.offset + 30 + nameLen + extraLen
+        return entry.dataOffset
+
+    def findFile(self, extension):
+        for entry in self.entries:
+            if entry.name.split('.')[-1] == extension:
+                return entry.name
+        return ''
+
+    def getEntry(self, name):
+        name = os.path.normpath(name).replace('\\', '/')
+        return self.entryMap.get(name)
+
+    def getFileBuffer(self, name):
+        entry = self.getEntry(name)
+        if entry == None:
+            return None
+        start = self.getDataOffset(entry)
+        view = memoryview(self.buffer)[start:start + entry.compressedSize]
+        if entry.method == 0:
+            return view
+        # Compressed entries are not part of the usdz spec but still load
+        data = zlib.decompress(view, -15)
+        view.release()
+        return data
+
+    def openFile(self, name):
+        buffer = self.getFileBuffer(name)
+        if buffer == None:
+            return None
+        return BufferFile(buffer)
+
+    def extractFile(self, name, dirPath):
+        buffer = self.getFileBuffer(name)
+        if buffer == None:
+            return ''
+        filePath = os.path.join(dirPath, os.path.basename(name))
+        file = open(filePath, 'wb')
+        file.write(buffer)
+        file.close()
+        return filePath
+
+    def close(self):
+        self.buffer = b''
+        if self.mapping != None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                # Imported arrays still view the mapping and keep it open
+                pass
+            self.mapping = None
@@ -1,7 +1,18 @@
 from enum import Enum
+from types import MappingProxyType
 
 TAB = '   '
 
+# Shared read only containers until an item is first written
+EMPTY_MAP = MappingProxyType({})
+EMPTY_LIST = ()
+
+# Number of array items formatted at a time by the usda writer
+ARRAY_CHUNK_SIZE = 4096
+
+# Attributes with the same qualifiers share one tuple
+QUALIFIER_TUPLES = {}
+
 
 class SpecifierType(Enum):
     Def = 0
@@ -132,8 +143,32 @@ def getTupleValueType(value):
     return ValueType.Invalid
 
 
+def getArrayValueType(array):
+    # NumPy arrays are typed like the lists they replace
+    kind = array.dtype.kind
+    if array.ndim == 0:
+        return getValueType(array.tolist())
+    if array.ndim == 1:
+        if kind == 'b':
+            return ValueType.bool
+        if kind in 'iu':
+            return ValueType.int
+        if kind == 'f':
+            return ValueType.float
+    elif array.ndim == 2 and array.shape[1] in (2, 3, 4):
+        if kind in 'iu':
+            return ValueType['vec%di' % array.shape[1]]
+        if kind == 'f':
+            return ValueType['vec%df' % array.shape[1]]
+    elif array.ndim == 3 and array.shape[1] == array.shape[2] and array.shape[1] in (2, 3, 4):
+        return ValueType['matrix%dd' % array.shape[1]]
+    return ValueType.Invalid
+
+
 def getValueType(value):
     t = type(value)
+    if hasattr(value, 'tolist'):
+        return getArrayValueType(value)
     if t == bool:
         return ValueType.bool
     if t == int:
@@ -172,7 +207,24 @@ def getValueTypeFromStr(typeStr):
         return ValueType.vec4d
     return ValueType[typeStr]
 
+def listToTuples(value):
+    if type(value) is list:
+        return tuple(listToTuples(v) for v in value)
+    return value
+
+def arrayToList(array):
+    # Rows of NumPy arrays read back as tuples like decoded values
+    return [listToTuples(item) for item in array.tolist()]
+
+def isArrayValue(value):
+    return type(value) is list or hasattr(value, 'tolist')
+
 def valueToString(value, reduced = False):
+    if hasattr(value, 'tolist'):
+        if reduced and len(value) > 3:
+            value = arrayToList(value[:3]) + ['...']
+            return '[' + ', '.join(valueToString(item) for item in value) + ']'
+        value = arrayToList(value)
     if type(value) is str:
         return value
     if type(value) is int:
@@ -190,6 +242,33 @@ def valueToString(value, reduced = False):
         return '(' + ', '.join(valueToString(item) for item in value) + ')'
     return ''
 
+def formatArrayChunk(items):
+    # Rows of floats are formatted with one template
+    if len(items) > 0 and type(items[0]) is tuple:
+        size = len(items[0])
+        flat = [f for item in items for f in item]
+        if len(flat) == size * len(items) and set(map(type, flat)) == {float}:
+            row = '(' + ', '.join(['%.6g'] * size) + ')'
+            return ', '.join([row] * len(items)) % tuple([round(f, 6) for f in flat])
+    elif len(items) > 0 and set(map(type, items)) == {float}:
+        return ', '.join(['%.6g'] * len(items)) % tuple([round(f, 6) for f in items])
+    elif len(items) > 0 and set(map(type, items)) == {int}:
+        return ', '.join(map(str, items))
+    return ', '.join(valueToString(item) for item in items)
+
+def iterValueString(value, reduced = False):
+    # Arrays are written in chunks instead of one joined string
+    if reduced or not isArrayValue(value):
+        yield valueToString(value, reduced)
+        return
+    yield '['
+    for start in range(0, len(value), ARRAY_CHUNK_SIZE):
+        items = value[start:start + ARRAY_CHUNK_SIZE]
+        if hasattr(items, 'tolist'):
+            items = arrayToList(items)
+        yield (', ' if start > 0 else '') + formatArrayChunk(items)
+    yield ']'
+
 def dictionaryToString(dic, space):
     indent = space + TAB
     ret = '{\n'
@@ -222,13 +301,69 @@ def propertyToString(prop, space):
 def interleaveLists(lists):
     return [x for x in itertools.chain(*itertools.zip_longest(*lists)) if x is not None]
 
+def invalidateTypeCounts(item):
+    # Ancestors of a stale item are already stale so the walk stops early
+    while item != None and item.typeCounts != None:
+        item.typeCounts = None
+        item = item.parent
+
+def updateTypeCounts(item):
+    # Count the prim types of every stale subtree in one post-order pass
+    if item.typeCounts == None:
+        counts = {}
+        for child in item.children:
+            for type, count in updateTypeCounts(child).items():
+                counts[type] = counts.get(type, 0) + count
+            counts[child.classType] = counts.get(child.classType, 0) + 1
+        item.typeCounts = counts
+    return item.typeCounts
+
+def collectChildrenOfType(item, type, children):
+    for child in item.children:
+        if child.classType == type:
+            children.append(child)
+        if child.typeCounts.get(type, 0) > 0:
+            collectChildrenOfType(child, type, children)
+    return children
+
+def updatePathJumps(item):
+    # Prims jump over their items to the next sibling
+    for child in item.children:
+        child.pathJump = child.itemCount + 1
+    if len(item.children) > 0 and len(item.attributes) == 0:
+        item.children[-1].pathJump = -1
+
+class LazyValue:
+    """Value Decoded on First Access"""
+
+    def __init__(self, loader, *args):
+        self.loader = loader
+        self.args = args
+        self.value = None
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            self.value = self.loader(*self.args)
+            self.loaded = True
+        return self.value
+
+    def release(self):
+        self.value = None
+        self.loaded = False
+
+
 class UsdAttribute:
+    __slots__ = ('name', '_value', '_frames', '_qualifiers',
+                 'metadata', 'valueType', 'valueTypeStr', 'parent',
+                 'pathIndex', 'pathJump')
+
     def __init__(self, name = '', value = None, type = ValueType.Invalid):
         self.name = name
         self.value = value
-        self.frames = []
-        self.qualifiers = []
-        self.metadata = {}
+        self.frames = EMPTY_LIST
+        self._qualifiers = EMPTY_LIST
+        self.metadata = EMPTY_MAP
         self.valueType = type
         self.valueTypeStr = None
         self.parent = None
@@ -243,12 +378,53 @@ class UsdAttribute:
         return self.toString()
 
     def __setitem__(self, key, item):
+        if self.metadata is EMPTY_MAP:
+            self.metadata = {}
         self.metadata[key] = item
 
     def __getitem__(self, key):
         return self.metadata[key]
 
+    @property
+    def qualifiers(self):
+        return self._qualifiers
+
+    @property
+    def value(self):
+        if type(self._value) is LazyValue:
+            return self._value.load()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    @property
+    def frames(self):
+        if type(self._frames) is LazyValue:
+            return self._frames.load()
+        return self._frames
+
+    @frames.setter
+    def frames(self, frames):
+        self._frames = frames
+
+    def releaseValue(self):
+        for item in (self._value, self._frames):
+            if type(item) is LazyValue:
+                item.release()
+
+    def clearValue(self):
+        # Drop a written value but keep its type name
+        if not self.isConnection() and not self.isRelationship():
+            self.valueTypeStr = self.valueTypeToString()
+            self.value = None
+            self.frames = EMPTY_LIST
+
     def toString(self, space = '', debug = False):
+        return ''.join(self.iterString(space, debug))
+
+    def iterString(self, space = '', debug = False):
         ret = space
         att = self.value if self.isConnection() else self
         if len(att.qualifiers) > 0:
@@ -260,13 +436,17 @@ class UsdAttribute:
         elif self.isRelationship():
             ret += ' = <' + self.value.getPathStr() + '>'
         elif self.hasTimeSamples():
-            ret += self.framesToString(space, debug)
+            yield ret
+            yield from self.iterFramesString(space, debug)
+            ret = ''
         else:
-            if self.value != None:
-                ret += ' = ' + self.valueToString(debug)
+            if self.value is not None:
+                yield ret + ' = '
+                yield from self.iterValueString(debug)
+                ret = ''
                 if len(self.metadata) > 0:
                     ret += self.metadataToString(space)
-        return ret + '\n'
+        yield ret + '\n'
 
     def metadataToString(self, space):
         indent = space + TAB
@@ -276,23 +456,32 @@ class UsdAttribute:
         return ret + space + ')'
 
     def framesToString(self, space, debug = False):
+        return ''.join(self.iterFramesString(space, debug))
+
+    def iterFramesString(self, space, debug = False):
         indent = space + TAB
-        ret = '.timeSamples = {\n'
+        yield '.timeSamples = {\n'
         if debug and len(self.frames) > 3:
             for frame, value in self.frames[:3]:
-                ret += indent + '%d: '%frame + valueToString(value) + ',\n'
-            ret += indent + '...\n'
+                yield indent + '%d: '%frame + valueToString(value) + ',\n'
+            yield indent + '...\n'
         else:
             for frame, value in self.frames:
-                ret += indent + '%d: '%frame + valueToString(value) + ',\n'
-        return ret + space + '}'
+                yield indent + '%d: '%frame
+                yield from iterValueString(value)
+                yield ',\n'
+        yield space + '}'
 
     def addQualifier(self, qualifier):
-        self.qualifiers.append(qualifier)
+        # Qualifiers keep the order they were added in
+        qualifiers = self._qualifiers + (qualifier,)
+        self._qualifiers = QUALIFIER_TUPLES.setdefault(qualifiers, qualifiers)
 
     def addTimeSample(self, frame, value):
         if self.valueType == ValueType.Invalid:
             self.valueType = getValueType(value)
+        if self._frames is EMPTY_LIST:
+            self._frames = []
         self.frames.append((frame, value))
 
     def valueToString(self, debug = False):
@@ -306,6 +495,12 @@ class UsdAttribute:
             return '@' + valueToString(self.value) + '@'
         return valueToString(self.value, debug)
 
+    def iterValueString(self, debug = False):
+        if self.isConnection() or self.valueType in (ValueType.token, ValueType.string, ValueType.asset):
+            yield self.valueToString(debug)
+        else:
+            yield from iterValueString(self.value, debug)
+
     def valueTypeToString(self):
         if self.valueTypeStr != None:
             return self.valueTypeStr + ('[]' if self.isArray() else '')
@@ -315,14 +510,14 @@ class UsdAttribute:
         if self.isConnection():
             return self.value.isArray()
         if len(self.frames) > 0:
-            return type(self.frames[0][1]) is list
-        return self.value != None and type(self.value) is list
+            return isArrayValue(self.frames[0][1])
+        return isArrayValue(self.value)
 
     def isConnection(self):
-        return type(self.value) is UsdAttribute
+        return type(self._value) is UsdAttribute
 
     def isRelationship(self):
-        return type(self.value) is UsdPrim
+        return type(self._value) is UsdPrim
 
     def hasTimeSamples(self):
         return len(self.frames) > 0
@@ -350,16 +545,26 @@ class UsdAttribute:
 
 
 class UsdPrim:
+    __slots__ = ('name', 'specifierType', 'classType', 'metadata',
+                 'attributes', 'children', 'attributeMap', 'childMap',
+                 'childTypes', 'typeCounts', 'parent', 'pathIndex',
+                 'pathJump', 'itemCount')
+
     def __init__(self, name = '', type = ClassType.Scope):
         self.name = name
         self.specifierType = SpecifierType.Def
         self.classType = type
         self.metadata = {}
-        self.attributes = []
-        self.children = []
+        self.attributes = EMPTY_LIST
+        self.children = EMPTY_LIST
+        self.attributeMap = EMPTY_MAP
+        self.childMap = EMPTY_MAP
+        self.childTypes = EMPTY_MAP
+        self.typeCounts = EMPTY_MAP
         self.parent = None
         self.pathIndex = -1
         self.pathJump = -1
+        self.itemCount = 0
 
     def __str__(self):
         return self.toString()
@@ -371,12 +576,15 @@ class UsdPrim:
             self.createAttribute(key, item)
 
     def __getitem__(self, key):
-        return next((att for att in self.attributes if att.name == key), None)
+        return self.attributeMap.get(key)
 
     def __contains__(self, key):
-        return self[key] != None
+        return key in self.attributeMap
 
     def toString(self, space = '', debug = False):
+        return ''.join(self.iterString(space, debug))
+
+    def iterString(self, space = '', debug = False):
         indent = space + TAB
         line = indent + '\n'
         ret = space + self.specifierType.name.lower() + ' '
@@ -387,11 +595,13 @@ class UsdPrim:
             ret += self.metadataToString(space)
         else:
             ret += '\n'
-        ret += space + '{\n'
-        ret += ''.join(att.toString(indent, debug) for att in self.attributes)
-        ret += line if len(self.children) > 0 else ''
-        ret += line.join(c.toString(indent, debug) for c in self.children)
-        return ret + space + '}\n'
+        yield ret + space + '{\n'
+        for att in self.attributes:
+            yield from att.iterString(indent, debug)
+        for child in self.children:
+            yield line
+            yield from child.iterString(indent, debug)
+        yield space + '}\n'
 
     def metadataToString(self, space):
         ret = ' (\n'
@@ -401,7 +611,11 @@ class UsdPrim:
 
     def addAttribute(self, attribute):
         attribute.parent = self
+        if self.attributes is EMPTY_LIST:
+            self.attributes = []
+            self.attributeMap = {}
         self.attributes.append(attribute)
+        self.attributeMap.setdefault(attribute.name, attribute)
         return attribute
 
     def createAttribute(self, name, value = None, type = ValueType.Invalid):
@@ -409,12 +623,25 @@ class UsdPrim:
 
     def addChild(self, child):
         child.parent = self
+        if self.children is EMPTY_LIST:
+            self.children = []
+            self.childMap = {}
+            self.childTypes = {}
         self.children.append(child)
+        self.childMap.setdefault(child.name, child)
+        self.childTypes.setdefault(child.classType, child)
+        invalidateTypeCounts(self)
         return child
 
     def addChildFront(self, child):
         child.parent = self
-        self.children = [child] + self.children
+        if self.children is EMPTY_LIST:
+            self.childMap = {}
+            self.childTypes = {}
+        self.children = [child] + list(self.children)
+        self.childMap[child.name] = child
+        self.childTypes[child.classType] = child
+        invalidateTypeCounts(self)
         return child
 
     def createChild(self, name, type):
@@ -427,18 +654,14 @@ class UsdPrim:
         return [a for a in self.attributes if a.valueTypeToString() == typeStr]
 
     def getChild(self, name):
-        return next((c for c in self.children if c.name == name), None)
+        return self.childMap.get(name)
 
     def getChildOfType(self, type):
-        return next((c for c in self.children if c.classType == type), None)
+        return self.childTypes.get(type)
 
     def getChildrenOfType(self, type):
-        children = []
-        for child in self.children:
-            if child.classType == type:
-                children.append(child)
-            children += child.getChildrenOfType(type)
-        return children
+        updateTypeCounts(self)
+        return collectChildrenOfType(self, type, [])
 
     def getItemAtPathIndex(self, pathIndex):
         for att in self.attributes:
@@ -476,15 +699,28 @@ class UsdPrim:
             child.resolvePaths(root)
 
     def updatePathIndices(self, pathIndex):
+        start = pathIndex
         self.pathIndex = pathIndex
         pathIndex += 1
         for child in self.children:
             pathIndex = child.updatePathIndices(pathIndex)
         for att in self.attributes:
             att.pathIndex = pathIndex
+            att.pathJump = 0
             pathIndex += 1
+        if len(self.attributes) > 0:
+            self.attributes[-1].pathJump = -2
+        # Children are complete so their jumps are known
+        updatePathJumps(self)
+        self.itemCount = pathIndex - start - 1
         return pathIndex
 
+    def clearValues(self):
+        for att in self.attributes:
+            att.clearValue()
+        for child in self.children:
+            child.clearValues()
+
     def getPathStr(self):
         if self.parent == None:
             return '/' + self.name
@@ -511,8 +747,11 @@ class UsdData:
         self.metadata = {}
         self.children = []
         self.attributes = []
+        self.typeCounts = {}
+        self.parent = None
         self.pathIndex = 0
         self.pathJump = -1
+        self.pathMap = {}
 
     def __str__(self):
         return self.toString()
@@ -524,10 +763,14 @@ class UsdData:
         return self.metadata[key]
 
     def toString(self, debug = False):
-        ret = '#usda 1.0\n'
-        ret += self.metadataToString()
-        ret += '\n'
-        return ret + '\n'.join(c.toString('', debug) for c in self.children)
+        return ''.join(self.iterString(debug))
+
+    def iterString(self, debug = False):
+        yield '#usda 1.0\n' + self.metadataToString() + '\n'
+        for i, child in enumerate(self.children):
+            if i > 0:
+                yield '\n'
+            yield from child.iterString('', debug)
 
     def getPathStr(self):
         return ''
@@ -541,26 +784,26 @@ class UsdData:
     def addChild(self, child):
         child.parent = self
         self.children.append(child)
+        invalidateTypeCounts(self)
         return child
 
     def createChild(self, name, type):
         return self.addChild(UsdPrim(name, type))
 
     def getChildrenOfType(self, type):
-        children = []
-        for child in self.children:
-            if child.classType == type:
-                children.append(child)
-            children += child.getChildrenOfType(type)
-        return children
+        updateTypeCounts(self)
+        return collectChildrenOfType(self, type, [])
 
     def getAllMaterials(self):
         return self.getChildrenOfType(ClassType.Material)
 
     def updatePathIndices(self):
+        self.pathMap = {}
         pathIndex = 1
         for child in self.children:
             pathIndex = child.updatePathIndices(pathIndex)
+        updatePathJumps(self)
+        self.getPathJump()
 
     def getPathJump(self):
         self.pathJump = -1 if len(self.children) > 0 else -2
@@ -568,6 +811,9 @@ class UsdData:
         return self.pathJump
 
     def getItemAtPathIndex(self, pathIndex):
+        # Items read from a crate file are indexed by their path
+        if pathIndex in self.pathMap:
+            return self.pathMap[pathIndex]
         for child in self.children:
             if child.pathIndex == pathIndex:
                 return child
@@ -581,6 +827,8 @@ class UsdData:
             child.resolvePaths(self)
 
     def writeUsda(self, filePath):
+        # Stream the text to the file instead of building one string
         f = open(filePath, 'w')
-        f.write(str(self))
+        for chunk in self.iterString():
+            f.write(chunk)
         f.close()
@@ -0,0 +1,48 @@
+import bpy
+import sys
+import tracemalloc
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.value_types
+
+importlib.reload(io_scene_usdz.value_types)
+
+
+from io_scene_usdz.value_types import *
+
+
+def createScene(numPrims, numAttributes):
+    # Shaders with many scalar inputs, some with qualifiers or metadata
+    data = UsdData()
+    looks = data.createChild('Looks', ClassType.Scope)
+    for p in range(numPrims):
+        shader = looks.createChild('Shader%d' % p, ClassType.Shader)
+        for a in range(numAttributes):
+            shader['inputs:value%d' % a] = 0.5
+            if a % 10 == 0:
+                shader['inputs:value%d' % a].addQualifier('uniform')
+            if a % 25 == 0:
+                shader['inputs:value%d' % a]['interpolation'] = 'vertex'
+    return data
+
+
+numPrims = 2000
+numAttributes = 50
+tracemalloc.start()
+start = tracemalloc.take_snapshot()
+data = createScene(numPrims, numAttributes)
+stats = tracemalloc.take_snapshot().compare_to(start, 'filename')
+tracemalloc.stop()
+
+total = sum(stat.size_diff for stat in stats)
+count = numPrims * numAttributes
+print('Attributes: %d, Prims: %d' % (count, numPrims + 1))
+print('Total: %.2f MB, Per Attribute: %.1f bytes' % (total / (1024 * 1024), total / count))
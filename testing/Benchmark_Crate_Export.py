@@ -0,0 +1,116 @@
+import bpy
+import io
+import struct
+import sys
+import time
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.crate_file
+
+importlib.reload(io_scene_usdz.crate_file)
+
+
+from io_scene_usdz.crate_file import *
+
+
+class CountingFile(io.BytesIO):
+    """In Memory File that Counts Write Calls"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def write(self, data):
+        self.calls += 1
+        return super().write(data)
+
+
+def createUsdData(numMeshes, numPoints):
+    # Meshes with large point, index and uv arrays
+    data = UsdData()
+    data['upAxis'] = 'Y'
+    for m in range(numMeshes):
+        xform = data.createChild('Object%d' % m, ClassType.Xform)
+        mesh = xform.createChild('Mesh%d' % m, ClassType.Mesh)
+        mesh['faceVertexCounts'] = [4] * (numPoints // 4)
+        mesh['faceVertexIndices'] = list(range(numPoints))
+        mesh['points'] = [(float(i % 100), float(i // 100), float(m)) for i in range(numPoints)]
+        mesh['points'].valueTypeStr = 'point3f'
+        mesh['primvars:st'] = [(float(i % 7) / 7.0, 0.25) for i in range(numPoints)]
+        mesh['primvars:st'].valueTypeStr = 'texCoord2f'
+        mesh['primvars:st:indices'] = list(range(numPoints))
+        mesh['widths'] = [float(i % 3) for i in range(numPoints)]
+    return data
+
+
+def iterAttributes(item):
+    for att in item.attributes:
+        yield att
+    for child in item.children:
+        yield from iterAttributes(child)
+
+
+def writeArraysPerValue(file, data):
+    # Float and vector arrays written one value at a time like the writer
+    # before batching, int arrays are compressed in both writers
+    for att in iterAttributes(data):
+        values = att.value
+        if type(values) is list and len(values) > 0 and type(values[0]) is not int:
+            writeInt(file, len(values), 8)
+            if type(values[0]) is tuple:
+                packStr = '<%df' % len(values[0])
+                for v in values:
+                    file.write(struct.pack(packStr, *v))
+            else:
+                for f in values:
+                    writeFloat(file, f)
+
+
+def writeArraysBatched(file, data):
+    # The same arrays packed with one call each like the current writer
+    for att in iterAttributes(data):
+        values = att.value
+        if type(values) is list and len(values) > 0 and type(values[0]) is not int:
+            writeInt(file, len(values), 8)
+            if type(values[0]) is tuple:
+                file.write(packVectors(values, 'f'))
+            else:
+                file.write(packValues(values, 'f'))
+
+
+def benchmarkArrays(name, data, writeArrays):
+    file = CountingFile()
+    start = time.perf_counter()
+    writeArrays(file, data)
+    elapsed = time.perf_counter() - start
+    size = len(file.getvalue()) / (1024 * 1024)
+    print('%-12s %8.3f s %10d calls %12.1f calls/MB' % (name, elapsed, file.calls, file.calls / size))
+    return file.getvalue()
+
+
+def benchmark(name, data, bufferSize):
+    file = CountingFile()
+    crate = CrateFile(file, bufferSize = bufferSize)
+    start = time.perf_counter()
+    crate.writeUsd(data)
+    elapsed = time.perf_counter() - start
+    size = len(file.getvalue()) / (1024 * 1024)
+    print('%-12s %8.3f s %10d calls %12.1f calls/MB' % (name, elapsed, file.calls, file.calls / size))
+    return file.getvalue()
+
+
+data = createUsdData(10, 20000)
+perValue = benchmarkArrays('per value', data, writeArraysPerValue)
+batched = benchmarkArrays('batched', data, writeArraysBatched)
+assert perValue == batched
+unbuffered = benchmark('unbuffered', data, 0)
+buffered = benchmark('buffered', data, WRITE_BUFFER_SIZE)
+assert unbuffered == buffered
@@ -0,0 +1,90 @@
+import bpy
+import sys
+import time
+import random
+import struct
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.compression_utils
+
+importlib.reload(io_scene_usdz.compression_utils)
+
+
+from io_scene_usdz.compression_utils import *
+
+
+def lz4DecompressChunkReference(src):
+    # Per-byte match copy used before the slice based decompressor
+    dst = bytearray()
+    srcLen = len(src)
+    srcPtr = 0
+    while srcPtr < srcLen:
+        token = src[srcPtr]
+        srcPtr += 1
+        litLen = (token >> 4) & 0x0F
+        if litLen == 15:
+            while src[srcPtr] == 255:
+                litLen += 255
+                srcPtr += 1
+            litLen += src[srcPtr]
+            srcPtr += 1
+        dst += src[srcPtr:srcPtr + litLen]
+        srcPtr += litLen
+        if srcPtr >= srcLen:
+            break
+        offset = int.from_bytes(src[srcPtr:srcPtr + 2], 'little')
+        srcPtr += 2
+        matchLen = token & 0x0F
+        if matchLen == 15:
+            while src[srcPtr] == 255:
+                matchLen += 255
+                srcPtr += 1
+            matchLen += src[srcPtr]
+            srcPtr += 1
+        matchLen += MIN_MATCH
+        for i in range(matchLen):
+            dst.append(dst[len(dst) - offset])
+    return dst
+
+
+def createPointsBuffer(count):
+    # Grid of points similar to a subdivided mesh
+    random.seed(0)
+    points = []
+    for i in range(count):
+        points += [float(i % 100), float(i // 100), random.choice((0.0, 0.5))]
+    return struct.pack('<%df' % len(points), *points)
+
+
+def benchmark(name, func, data, repeats = 3):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    rate = len(result) / best / (1024 * 1024)
+    print('%-12s %8.3f s %10.2f MB/s' % (name, best, rate))
+    return result
+
+
+src = createPointsBuffer(200000)
+compressed = memoryview(lz4Compress(src))[1:]
+print('Uncompressed: %d bytes, Compressed: %d bytes' % (len(src), len(compressed)))
+
+reference = benchmark('reference', lz4DecompressChunkReference, compressed)
+python = benchmark('python', lz4DecompressChunkPython, compressed)
+assert python == reference
+if lz4Block != None:
+    native = benchmark('lz4.block', lz4DecompressChunkNative, compressed)
+    assert native == reference
+else:
+    print('lz4.block not available')
@@ -0,0 +1,82 @@
+import bpy
+import os
+import sys
+import shutil
+import tracemalloc
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.value_types
+import io_scene_usdz.crate_file
+import io_scene_usdz.object_utils
+import io_scene_usdz.mesh_cache
+import io_scene_usdz.scene_data
+import io_scene_usdz.export_usdz
+
+importlib.reload(io_scene_usdz.value_types)
+importlib.reload(io_scene_usdz.crate_file)
+importlib.reload(io_scene_usdz.object_utils)
+importlib.reload(io_scene_usdz.mesh_cache)
+importlib.reload(io_scene_usdz.scene_data)
+importlib.reload(io_scene_usdz.export_usdz)
+
+
+from io_scene_usdz.export_usdz import export_usdz
+
+
+exportsDir = bpy.path.abspath("//") + 'exports/'
+if not os.path.exists(exportsDir):
+    os.makedirs(exportsDir)
+cacheDir = exportsDir + 'mesh_cache/'
+
+
+def createGrids(numMeshes, subdivisions):
+    # Each grid gets its own mesh data so none of them are shared
+    grids = []
+    for i in range(numMeshes):
+        bpy.ops.mesh.primitive_grid_add(x_subdivisions = subdivisions,
+                                        y_subdivisions = subdivisions,
+                                        location = (i * 3.0, 0.0, 0.0))
+        grids.append(bpy.context.active_object)
+    bpy.ops.object.select_all(action = 'DESELECT')
+    for grid in grids:
+        grid.select_set(True)
+    return grids
+
+
+def deleteGrids(grids):
+    for grid in grids:
+        mesh = grid.data
+        bpy.data.objects.remove(grid)
+        bpy.data.meshes.remove(mesh)
+
+
+def measureExport(numMeshes, subdivisions = 200):
+    grids = createGrids(numMeshes, subdivisions)
+    filePath = exportsDir + 'mesh_cache.usdc'
+    # The first export fills the cache, the second reads every mesh from it
+    export_usdz(context = bpy.context, filepath = filePath, meshCachePath = cacheDir)
+    tracemalloc.start()
+    export_usdz(context = bpy.context, filepath = filePath, meshCachePath = cacheDir)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    deleteGrids(grids)
+    os.remove(filePath)
+    shutil.rmtree(cacheDir)
+    print('Meshes: %d, Peak: %.2f MB' % (numMeshes, peak / (1024 * 1024)))
+    return peak
+
+
+smallPeak = measureExport(4)
+largePeak = measureExport(16)
+# Cached arrays are loaded one mesh at a time, so four times the meshes
+# should not come close to four times the peak
+print('Peak Ratio: %.2f' % (largePeak / smallPeak))
+assert largePeak < smallPeak * 1.5, 'Mesh cache peak memory grows with the mesh count'
@@ -0,0 +1,63 @@
+import bpy
+import sys
+import time
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.value_types
+
+importlib.reload(io_scene_usdz.value_types)
+
+
+from io_scene_usdz.value_types import *
+
+
+def createHierarchy(numChains, depth):
+    # Deep chains of transforms with an attribute on every prim
+    data = UsdData()
+    for c in range(numChains):
+        parent = data.createChild('Chain%d' % c, ClassType.Xform)
+        parent['visibility'] = 'inherited'
+        for d in range(depth - 1):
+            parent = parent.createChild('Node%d' % d, ClassType.Xform)
+            parent['visibility'] = 'inherited'
+    return data
+
+
+def getItems(item):
+    items = []
+    for child in item.children:
+        items.append(child)
+        items += getItems(child)
+    for att in item.attributes:
+        items.append(att)
+    return items
+
+
+def recursiveJumps(items):
+    # Subtree counts for every prim as the writer used to compute them
+    return [item.getPathJump() for item in items]
+
+
+data = createHierarchy(400, 250)
+items = getItems(data)
+print('Prims: %d, Items: %d' % (len(items) // 2, len(items)))
+
+start = time.perf_counter()
+data.updatePathIndices()
+elapsed = time.perf_counter() - start
+jumps = [item.pathJump for item in items]
+print('%-12s %8.3f s' % ('post-order', elapsed))
+
+start = time.perf_counter()
+reference = recursiveJumps(items)
+elapsed = time.perf_counter() - start
+print('%-12s %8.3f s' % ('recursive', elapsed))
+assert jumps == reference
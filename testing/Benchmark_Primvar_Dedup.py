@@ -0,0 +1,57 @@
+import bpy
+import sys
+import time
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.object_utils
+
+importlib.reload(io_scene_usdz.object_utils)
+
+
+from io_scene_usdz.object_utils import *
+
+
+def createLoopUvs(count):
+    # Grid uvs shared by neighbouring loops like an unwrapped mesh
+    rng = np.random.default_rng(0)
+    cells = rng.integers(0, 512, size = (count, 2))
+    return (cells / 511.0).astype(np.float32)
+
+
+def indexValuesDict(values):
+    # Tuple at a time deduplication used before indexValues
+    indices = []
+    uniques = []
+    valueMap = {}
+    for value in values.tolist():
+        addValueIndex(valueMap, uniques, indices, tuple(value))
+    return (indices, uniques)
+
+
+def benchmark(name, func, *args, repeats = 3):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    print('%-12s %8.3f s %10d values' % (name, best, len(result[1])))
+    return result
+
+
+uvs = createLoopUvs(2000000)
+print('Loops: %d' % len(uvs))
+
+dictIndices, dictValues = benchmark('dict', indexValuesDict, uvs)
+indices, values = benchmark('np.unique', indexValues, uvs)
+assert indices.tolist() == dictIndices
+assert [tuple(v) for v in values.tolist()] == dictValues
+benchmark('welded', indexValues, uvs, 0.01)
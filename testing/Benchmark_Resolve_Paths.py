@@ -0,0 +1,78 @@
+import bpy
+import io
+import sys
+import time
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.value_types
+import io_scene_usdz.crate_file
+
+importlib.reload(io_scene_usdz.value_types)
+importlib.reload(io_scene_usdz.crate_file)
+
+
+from io_scene_usdz.crate_file import *
+
+
+def createConnectedData(numMaterials, numConnections):
+    # Materials with every input connected to a shader output
+    data = UsdData()
+    data['upAxis'] = 'Y'
+    looks = data.createChild('Looks', ClassType.Scope)
+    for m in range(numMaterials):
+        material = looks.createChild('Material%d' % m, ClassType.Material)
+        shader = material.createChild('Shader', ClassType.Shader)
+        shader['info:id'] = 'UsdPreviewSurface'
+        for c in range(numConnections):
+            shader['outputs:out%d' % c] = ValueType.float
+            material['inputs:in%d' % c] = shader['outputs:out%d' % c]
+    return data
+
+
+def linearLookup(data, pathIndex):
+    # Recursive search used before the path index map
+    for child in data.children:
+        if child.pathIndex == pathIndex:
+            return child
+        item = child.getItemAtPathIndex(pathIndex)
+        if item != None:
+            return item
+    return None
+
+
+numMaterials = 1000
+numConnections = 50
+file = io.BytesIO()
+CrateFile(file).writeUsd(createConnectedData(numMaterials, numConnections))
+print('Connections: %d, File Size: %d bytes' % (numMaterials * numConnections, len(file.getvalue())))
+
+start = time.perf_counter()
+data = CrateFile(io.BytesIO(file.getvalue())).readUsd()
+elapsed = time.perf_counter() - start
+print('%-12s %8.3f s' % ('readUsd', elapsed))
+
+# Look up as many items as there are connections
+pathIndices = list(data.pathMap.keys())
+lookups = [pathIndices[i % len(pathIndices)] for i in range(numMaterials * numConnections)]
+start = time.perf_counter()
+for pathIndex in lookups:
+    data.getItemAtPathIndex(pathIndex)
+elapsed = time.perf_counter() - start
+print('%-12s %8.3f s' % ('indexed', elapsed))
+
+# Time a sample of the linear lookups and scale to every connection
+sample = pathIndices[::len(pathIndices) // 200]
+start = time.perf_counter()
+for pathIndex in sample:
+    assert linearLookup(data, pathIndex) == data.pathMap[pathIndex]
+elapsed = time.perf_counter() - start
+estimate = elapsed / len(sample) * numMaterials * numConnections
+print('%-12s %8.3f s (estimated from %d lookups)' % ('linear', estimate, len(sample)))
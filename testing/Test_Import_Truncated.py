@@ -0,0 +1,99 @@
+import bpy
+import os
+import sys
+import importlib
+
+scriptPath = bpy.path.abspath("//") + '//..'
+if not scriptPath in sys.path:
+    sys.path.append(scriptPath)
+
+import io_scene_usdz
+
+importlib.reload(io_scene_usdz)
+
+import io_scene_usdz.compression_utils
+import io_scene_usdz.value_types
+import io_scene_usdz.crate_file
+import io_scene_usdz.usda_file
+import io_scene_usdz.import_usdz
+
+importlib.reload(io_scene_usdz.compression_utils)
+importlib.reload(io_scene_usdz.value_types)
+importlib.reload(io_scene_usdz.crate_file)
+importlib.reload(io_scene_usdz.usda_file)
+importlib.reload(io_scene_usdz.import_usdz)
+
+
+from io_scene_usdz.value_types import UsdData, ClassType
+from io_scene_usdz.crate_file import CrateFile
+from io_scene_usdz.import_usdz import import_usdz, readUsdFile
+from io_scene_usdz.usda_file import UsdaFile
+
+
+exportsDir = bpy.path.abspath("//") + 'exports/'
+if not os.path.exists(exportsDir):
+    os.makedirs(exportsDir)
+
+
+def createTestData():
+    data = UsdData()
+    data['upAxis'] = 'Y'
+    mesh = data.createChild('Mesh', ClassType.Mesh)
+    mesh['points'] = [(float(i), 0.0, 1.0) for i in range(300)]
+    mesh['faceVertexCounts'] = [3] * 100
+    mesh['faceVertexIndices'] = list(range(300))
+    mesh.createAttribute('primvars:st', [(0.5, 0.5)] * 300).addQualifier('custom')
+    return data
+
+
+def writeTruncated(filePath, contents, size):
+    file = open(filePath, 'wb')
+    file.write(contents[:size])
+    file.close()
+
+
+def readFileContents(filePath):
+    file = open(filePath, 'rb')
+    contents = file.read()
+    file.close()
+    return contents
+
+
+def testTruncated(fileName, contents, createReader):
+    filePath = exportsDir + fileName
+    # The complete file has to parse or the truncated ones prove nothing
+    writeTruncated(filePath, contents, len(contents))
+    file = open(filePath, 'rb')
+    reader = createReader(file)
+    usdData = readUsdFile(reader)
+    reader.close()
+    file.close()
+    assert usdData != None, 'Failed to read complete ' + fileName
+    # Cut through the whole file and through the last few bytes
+    sizes = list(range(0, len(contents), max(1, len(contents) // 50)))
+    sizes += list(range(max(0, len(contents) - 8), len(contents)))
+    failed = 0
+    for size in sizes:
+        writeTruncated(filePath, contents, size)
+        result = import_usdz(context = bpy.context, filepath = filePath)
+        if result != {'CANCELLED'}:
+            print('Truncated at %d bytes returned %s' % (size, result))
+            failed += 1
+    os.remove(filePath)
+    print('%s: %d of %d truncated imports not cancelled' % (fileName, failed, len(sizes)))
+    return failed
+
+
+data = createTestData()
+usdcPath = exportsDir + 'truncated.usdc'
+crateFile = open(usdcPath, 'wb')
+CrateFile(crateFile).writeUsd(data)
+crateFile.close()
+usdcContents = readFileContents(usdcPath)
+# Without its trailing newline every cut removes part of the text
+usdaContents = data.toString().encode('utf-8').rstrip()
+
+failed = testTruncated('truncated.usdc', usdcContents, CrateFile)
+failed += testTruncated('truncated.usda', usdaContents, UsdaFile)
+assert failed == 0, 'Truncated files were imported'
+print('Truncated imports cancelled')